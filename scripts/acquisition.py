@@ -0,0 +1,299 @@
+#!/usr/bin/python
+
+import time
+import threading
+import numpy as np
+
+# deadline-based acquisition scheduler for arrays of TeraRanger sensors
+
+def firingGroups(adjacency, sensorCount):
+    "Split the sensors into groups with no two interfering sensors, by greedy colouring of the crosstalk graph"
+
+    neighbours = [set() for i in range(sensorCount)]
+    for a, b in adjacency: # pairs of sensors that interfere when fired together
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+
+    colour = {}
+    for i in sorted(range(sensorCount), key=lambda i: -len(neighbours[i])): # most constrained first
+        used = set(colour[j] for j in neighbours[i] if j in colour)
+        c = 0
+        while c in used:
+            c += 1
+        colour[i] = c
+
+    groups = [[] for c in range(max(colour.values()) + 1)] if colour else []
+    for i in range(sensorCount):
+        groups[colour[i]].append(i)
+    return groups
+
+def ringAdjacency(sensorCount, reach=1):
+    "Crosstalk graph of a ring where each sensor interferes with the next reach sensors on either side"
+
+    return [(i, (i + k) % sensorCount) for i in range(sensorCount) for k in range(1, reach + 1)
+            if (i + k) % sensorCount != i]
+
+class SweepScheduler:     # paces sensor reads against fixed per-sweep deadlines
+
+    def __init__(self, read, sensorCount, rate=50, clock=time.time, sleep=time.sleep, readAll=None,
+                 groups=None, readGroup=None):
+        self.sensorCount = sensorCount
+        self.rate = float(rate) # aggregate reads per second over all sensors
+        self.period = 1.0 / self.rate # time budget of a single read
+        self.clock = clock
+        self.sleep = sleep
+
+        # a sweep is a sequence of slots, each firing a set of sensors together
+        if groups is not None:
+            self.slots = [list(g) for g in groups] # crosstalk-free groups, e.g. from firingGroups
+            self.readSlot = readGroup # readGroup(indices) -> ranges, e.g. TeraRangerBus.readGroup
+        elif readAll is not None:
+            self.slots = [range(sensorCount)] # a single pipelined transaction set
+            self.readSlot = lambda indices: readAll()
+        else:
+            self.slots = [[i] for i in range(sensorCount)]
+            self.readSlot = lambda indices: [read(indices[0])] # read(index) -> range, e.g. TeraRangerBus.readRange
+
+        # a slot of k sensors gets k read budgets, so rate stays the aggregate read rate
+        self.deadlines = self.period * np.cumsum([len(slot) for slot in self.slots])
+        self.sweepPeriod = self.period * self.sensorCount
+
+        self.stamps = np.zeros(self.sensorCount) # clock() at which each range of the last sweep was read
+        self.start = None # deadline anchor of the current sweep
+        self.sweeps = 0
+        self.reads = 0
+        self.missed = 0 # reads whose slot finished after its deadline
+        self.missedSweeps = 0 # sweeps that finished after their deadline
+        self.windowStart = None
+        self.windowReads = 0
+        self.windowValid = np.zeros(self.sensorCount, dtype=np.int64)
+        self.achievedRate = 0.0
+        self.sensorRates = np.zeros(self.sensorCount) # valid readings per second of each sensor
+
+    def sweep(self, deb=False):
+        "Fire every slot once, each against its own deadline in the sweep, and return the ranges"
+
+        ranges = np.ones(self.sensorCount, dtype=np.int32)
+
+        now = self.clock()
+        if self.start is None or now - self.start > 2 * self.sweepPeriod:
+            self.start = now # first sweep, or too far behind to catch up: re-anchor
+
+        if self.windowStart is None:
+            self.windowStart = now
+
+        late = False
+
+        for j in range(len(self.slots)):
+            slot = self.slots[j]
+            deadline = self.start + self.deadlines[j]
+            ranges[slot] = self.readSlot(slot)
+            now = self.clock()
+            self.stamps[slot] = now
+
+            if now > deadline:
+                self.missed += len(slot)
+                late = True
+                if deb:
+                    print "sensors %s missed their deadline by %.1f ms" % (slot, 1000 * (now - deadline))
+            elif j < len(self.slots) - 1:
+                self.sleep(deadline - now) # spread the slots evenly over the sweep
+
+        return self.finishSweep(ranges, late)
+
+    def finishSweep(self, ranges, late):
+        "Hold the sweep to its deadline and update the counters"
+
+        now = self.clock()
+        sweepDeadline = self.start + self.sweepPeriod
+        if late or now > sweepDeadline:
+            self.missedSweeps += 1
+        elif now < sweepDeadline:
+            self.sleep(sweepDeadline - now)
+
+        self.start = sweepDeadline
+        self.sweeps += 1
+        self.reads += self.sensorCount
+        self.windowReads += self.sensorCount
+        self.windowValid += ranges != 1 # 1 is the driver's failed read value
+        self.updateRate()
+
+        return ranges
+
+    def updateRate(self, window=1.0):
+        "Refresh the achieved aggregate and per-sensor rates about once per window (seconds)"
+
+        now = self.clock()
+        elapsed = now - self.windowStart
+        if elapsed >= window:
+            self.achievedRate = self.windowReads / elapsed
+            self.sensorRates = self.windowValid / elapsed
+            self.windowStart = now
+            self.windowReads = 0
+            self.windowValid[:] = 0
+
+    def stats(self):
+        "Summary of the scheduler's performance since start"
+
+        return {'target_rate': self.rate,
+                'achieved_rate': self.achievedRate,
+                'sweep_rate': self.achievedRate / self.sensorCount,
+                'sensor_rates': list(self.sensorRates),
+                'sweeps': self.sweeps,
+                'reads': self.reads,
+                'missed_reads': self.missed,
+                'missed_sweeps': self.missedSweeps}
+
+class MultiBusAcquisition:     # one acquisition thread per I2C bus, merged into one timestamped sweep
+
+    def __init__(self, buses, indices, rate=50, clock=time.time, groups=None):
+        self.buses = buses # TeraRangerBus-like objects, one per physical bus
+        self.indices = [np.asarray(idx) for idx in indices] # position of each bus's sensors in the merged sweep
+        self.sensorCount = sum(len(idx) for idx in self.indices)
+        self.clock = clock
+        self.schedulers = []
+        for k in range(len(buses)):
+            bus = buses[k]
+            readAll = bus.readRanges if bus.pipelined or bus.batched else None # whole-sweep reads when they save transactions
+            busGroups = groups[k] if groups is not None else None # firing groups in the bus's own sensor order
+            self.schedulers.append(SweepScheduler(bus.readRange, bus.sensorCount, rate=rate, clock=clock, readAll=readAll,
+                                                  groups=busGroups, readGroup=bus.readGroup))
+
+        self.merged = np.ones(self.sensorCount, dtype=np.int32) # written by the bus threads
+        self.mergedStamps = np.zeros(self.sensorCount)
+        self.stamps = np.zeros(self.sensorCount) # read times of the ranges returned by the last sweep()
+        self.fresh = [False] * len(buses) # bus has delivered a sweep since the last merged sweep
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for k in range(len(self.buses)):
+            thread = threading.Thread(target=self.run, args=(k,), name="trone-bus%d" % (k))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def run(self, k):
+        "Acquisition loop of bus k; sweeps on different buses run concurrently"
+
+        scheduler = self.schedulers[k]
+        idx = self.indices[k]
+
+        while self.running:
+            ranges = scheduler.sweep()
+            with self.condition:
+                self.merged[idx] = ranges
+                self.mergedStamps[idx] = scheduler.stamps
+                self.fresh[k] = True
+                self.condition.notify_all()
+
+    def sweep(self, timeout=1.0):
+        "Wait until every bus has a new sweep, then return the merged ranges; self.stamps holds their read times"
+
+        deadline = self.clock() + timeout
+        with self.condition:
+            while not (self.fresh and all(self.fresh)) and self.running: # no buses: wait out the timeout rather than spin
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break # a stalled bus keeps its previous values and stamps
+                self.condition.wait(remaining)
+            self.fresh = [False] * len(self.buses)
+            self.stamps = self.mergedStamps.copy()
+            return self.merged.copy()
+
+    def stats(self):
+        "Scheduler statistics summed over all buses"
+
+        stats = [scheduler.stats() for scheduler in self.schedulers]
+        merged = dict((key, sum(s[key] for s in stats)) for key in stats[0] if key != 'sensor_rates')
+        rates = np.zeros(self.sensorCount)
+        for k in range(len(stats)):
+            rates[self.indices[k]] = stats[k]['sensor_rates']
+        merged['sensor_rates'] = list(rates)
+        merged['sweeps'] = min(s['sweeps'] for s in stats)
+        merged['sweep_rate'] = min(s['sweep_rate'] for s in stats) # the slowest bus sets the merged rate
+        return merged
+
+class LatestSweep:     # latest-value slot between one writer thread and any number of readers, without locks
+
+    def __init__(self, sensorCount, depth=4):
+        self.depth = depth # sweeps the writer may complete during one read() before the copy is retried
+        self.ranges = np.ones((depth, sensorCount), dtype=np.int32)
+        self.stamps = np.zeros((depth, sensorCount))
+        self.seq = 0 # sweeps written; the newest is in row seq % depth
+
+    def write(self, ranges, stamps):
+        "Store a sweep in the next row, then publish it with a single assignment"
+
+        k = (self.seq + 1) % self.depth
+        self.ranges[k] = ranges
+        self.stamps[k] = stamps
+        self.seq += 1 # only the writer thread assigns seq
+
+    def read(self):
+        "Copy of the newest sweep as (seq, ranges, stamps); seq is 0 until the first write"
+
+        while True:
+            seq = self.seq
+            k = seq % self.depth
+            ranges = self.ranges[k].copy()
+            stamps = self.stamps[k].copy()
+            if self.seq - seq < self.depth - 1: # row k cannot have been reused during the copy
+                return seq, ranges, stamps
+
+class AcquisitionThread:     # runs a scheduler's sweeps on its own thread, so slow consumers never delay a read
+
+    def __init__(self, scheduler, sensorCount, ring=None, status=None):
+        self.scheduler = scheduler # SweepScheduler or MultiBusAcquisition
+        self.latest = LatestSweep(sensorCount)
+        self.ring = ring # optional teraranger.RangeRing keeping the raw history
+        self.status = status # status() -> READ_* outcome of every sensor in the last sweep, for the ring
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="trone-acquisition")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            ranges = self.scheduler.sweep()
+            self.latest.write(ranges, self.scheduler.stamps)
+            if self.ring is not None:
+                self.ring.append(ranges, self.scheduler.stamps, self.status())
+
+    def read(self):
+        return self.latest.read()
+
+if __name__ == "__main__":
+
+    # dry run against a fake 5 ms read
+    scheduler = SweepScheduler(lambda i: time.sleep(0.005) or 1000 + i, 6, rate=50)
+    for i in range(20):
+        print scheduler.sweep()
+    print scheduler.stats()
+
+    # the same ring fired in crosstalk-free groups of opposite sensors
+    groups = firingGroups(ringAdjacency(6, reach=2), 6)
+    print "firing groups", groups
+    scheduler = SweepScheduler(None, 6, rate=50, groups=groups,
+                               readGroup=lambda indices: time.sleep(0.005) or [1000 + i for i in indices])
+    for i in range(20):
+        print scheduler.sweep()
+    print scheduler.stats()
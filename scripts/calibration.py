@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+import json
+import numpy as np
+
+# per-sensor range correction for the TeraRanger estimators, compiled once and applied to whole sweeps
+
+# two point calibration table of the quadrotor's six sensors, in metres:
+# raw reading at the near and far targets, then the true distance of the near and far targets
+RANGE_TABLE = np.array([[87, 131, 70, 112.5],
+        [58.5, 94.5, 51, 84],
+        [60.5, 92.5, 52, 84.5],
+        [94, 60.5, 86, 53.5],
+        [91, 57.5, 89.5, 56.5],
+        [141.5, 89.5, 134, 83]]) / 100.0
+
+def compileTable(M):
+    "Gain and offset of every sensor from a two point table, the line through (M[i,0], M[i,2]) and (M[i,1], M[i,3])"
+
+    M = np.asarray(M, dtype=float)
+    gain = (M[:, 2] - M[:, 3]) / (M[:, 0] - M[:, 1])
+    offset = M[:, 2] - gain * M[:, 0]
+    return gain, offset
+
+class RangeCalibration:     # one correction polynomial per sensor, evaluated for a whole range vector at once
+
+    def __init__(self, coeffs):
+        # row i holds sensor i's polynomial, highest power first (np.polyval order); [gain, offset] is linear
+        self.coeffs = np.array(coeffs, dtype=float).reshape(len(coeffs), -1)
+        self.sensorCount = self.coeffs.shape[0]
+
+    @staticmethod
+    def fromTable(M=RANGE_TABLE):
+        "Linear calibration compiled from a two point table"
+
+        gain, offset = compileTable(M)
+        return RangeCalibration(np.column_stack((gain, offset)))
+
+    @staticmethod
+    def fit(sensors, raw, reference, sensorCount, order=1):
+        "Least squares polynomial (order >= 1) of every sensor at once from (sensor, raw, reference) samples; also returns the rms residuals, NaN where a sensor is left uncorrected, and the finite sample counts"
+
+        sensors = np.asarray(sensors, dtype=int)
+        raw = np.asarray(raw, dtype=float)
+        reference = np.asarray(reference, dtype=float)
+        keep = np.isfinite(raw) & np.isfinite(reference)
+        sensors, raw, reference = sensors[keep], raw[keep], reference[keep]
+
+        # normal equations of all sensors, stacked: A[s] = V_s' V_s, b[s] = V_s' y_s
+        V = np.vander(raw, order + 1)
+        k = order + 1
+        A = np.empty((sensorCount, k, k))
+        b = np.empty((sensorCount, k))
+        for i in range(k):
+            b[:, i] = np.bincount(sensors, weights=V[:, i] * reference, minlength=sensorCount)
+            for j in range(k):
+                A[:, i, j] = np.bincount(sensors, weights=V[:, i] * V[:, j], minlength=sensorCount)
+
+        counts = np.bincount(sensors, minlength=sensorCount)
+        distinct = np.zeros(sensorCount, dtype=int) # no finite samples at all leaves every sensor uncorrected
+        if len(sensors):
+            pairs = np.unique(np.column_stack((sensors, raw)), axis=0)
+            distinct = np.bincount(pairs[:, 0].astype(int), minlength=sensorCount)
+        identity = np.zeros(k)
+        identity[-2] = 1 # fewer distinct raw values than coefficients makes A singular: leave the sensor uncorrected
+        short = distinct < k
+        A[short] = np.eye(k)
+        b[short] = identity
+
+        coeffs = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+        error = (V * coeffs[sensors]).sum(axis=1) - reference
+        rms = np.sqrt(np.bincount(sensors, weights=error ** 2, minlength=sensorCount) / np.maximum(counts, 1))
+        rms[short] = np.nan
+        return RangeCalibration(coeffs), rms, counts
+
+    @staticmethod
+    def load(path):
+        "Calibration written by save(), e.g. by fit_calibration.py"
+
+        with open(path) as f:
+            return RangeCalibration(json.load(f)['coeffs'])
+
+    def save(self, path, **info):
+        "Write the coefficients as JSON, with any extra fields (fit residuals, sample counts) alongside"
+
+        info['coeffs'] = self.coeffs.tolist()
+        with open(path, 'w') as f:
+            json.dump(info, f, indent=1)
+
+    def apply(self, ranges):
+        "Corrected ranges (metres) of a whole sweep; NaN stays NaN"
+
+        ranges = np.asarray(ranges, dtype=float)
+        out = self.coeffs[:, 0].copy() # Horner's rule, every sensor at once
+        for k in range(1, self.coeffs.shape[1]):
+            out = out * ranges + self.coeffs[:, k]
+        return out
+
+    def applyOne(self, range, i):
+        "Corrected range of sensor i alone"
+
+        out = 0.0
+        for c in self.coeffs[i]:
+            out = out * range + c
+        return out
+
+if __name__ == "__main__":
+
+    # the compiled table matches solving the 2x2 system per reading
+    calibration = RangeCalibration.fromTable()
+    ranges = np.array([0.9, 0.6, 0.7, 0.8, 0.75, 1.2])
+    M = RANGE_TABLE
+    for i in range(len(ranges)):
+        X = np.linalg.solve(np.array([[M[i, 0], 1], [M[i, 1], 1]]), M[i, 2:4])
+        print i, X[0] * ranges[i] + X[1], calibration.apply(ranges)[i], calibration.applyOne(ranges[i], i)
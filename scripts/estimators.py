@@ -0,0 +1,530 @@
+#!/usr/bin/python
+
+import time
+import collections
+import numpy as np
+
+# ROS-free estimator maths, wrapped by the estimator nodes and usable offline on logged sweeps.
+# every estimator has fit(ranges, roll, pitch) -> (dx, dy, yaw, r, residual), ranges in metres
+
+# sensor geometry of the six sensor quadrotor: mounting point (m) and pointing angle of each sensor in the body frame
+QUAD_OFFSET = np.array([[0.2615, -0.154, 0],
+        [0.2130, -0.1690, 0],
+        [-0.2130, -0.1690, 0],
+        [-0.2130, 0.1690, 0],
+        [0.2130, 0.1690, 0],
+        [0.2615, 0.1540, 0]])
+QUAD_ORIENT = [-np.pi/4, -np.pi/2, -np.pi/2, np.pi/2, np.pi/2, np.pi/4]
+
+def rotationX(angle):
+    "Rotation matrices about x, one per angle (stacked on the first axis for array input)"
+
+    c, s = np.cos(angle), np.sin(angle)
+    one, zero = np.ones_like(c), np.zeros_like(c)
+    return np.moveaxis(np.array([[one, zero, zero], [zero, c, -s], [zero, s, c]]), [0, 1], [-2, -1])
+
+def rotationY(angle):
+    "Rotation matrices about y, one per angle (stacked on the first axis for array input)"
+
+    c, s = np.cos(angle), np.sin(angle)
+    one, zero = np.ones_like(c), np.zeros_like(c)
+    return np.moveaxis(np.array([[c, zero, s], [zero, one, zero], [-s, zero, c]]), [0, 1], [-2, -1])
+
+def projectionOperator(roll, pitch):
+    "Operator taking body-frame vertices onto the tilted sensor plane and levelling them; stacked for array input"
+
+    body = np.matmul(rotationX(-roll), rotationY(-pitch)) # the estimators' bodyRotation(-pitch, -roll)
+    A = body[..., 0:2]
+    level = np.matmul(rotationY(pitch), rotationX(roll)) # euler_matrix(roll, pitch, 0, 'sxyz')
+    return np.matmul(level, np.matmul(A, np.swapaxes(A, -1, -2))) # A's columns are orthonormal: A A' projects
+
+def kasaFit(points):
+    "Algebraic (Kasa) circle through (n, 2) points: (dx, dy, r, rms radial residual)"
+
+    A = np.column_stack((2*points[:,0], 2*points[:,1], np.ones(len(points))))
+    B = points[:,0]**2 + points[:,1]**2
+    x = np.linalg.lstsq(A, B, rcond=-1)[0]
+    dx, dy = x[0], x[1]
+    r = np.sqrt(x[2] + dx**2 + dy**2)
+    residual = np.sqrt(np.mean((np.hypot(points[:,0] - dx, points[:,1] - dy) - r)**2))
+    return dx, dy, r, residual
+
+def taubinFit(points):
+    "Taubin algebraic circle through (n, 2) points, (dx, dy, r); less biased than Kasa on a partial arc"
+
+    # Chernov's Newton iteration on the Taubin characteristic polynomial, in centred coordinates
+    centroid = points.mean(axis=0)
+    X = points[:,0] - centroid[0]
+    Y = points[:,1] - centroid[1]
+    Z = X**2 + Y**2
+    Mxx, Myy, Mxy = np.mean(X*X), np.mean(Y*Y), np.mean(X*Y)
+    Mxz, Myz, Mzz = np.mean(X*Z), np.mean(Y*Z), np.mean(Z*Z)
+    Mz = Mxx + Myy
+    Cov_xy = Mxx*Myy - Mxy*Mxy
+    Var_z = Mzz - Mz*Mz
+    A3 = 4*Mz
+    A2 = -3*Mz*Mz - Mzz
+    A1 = Var_z*Mz + 4*Cov_xy*Mz - Mxz*Mxz - Myz*Myz
+    A0 = Mxz*(Mxz*Myy - Myz*Mxy) + Myz*(Myz*Mxx - Mxz*Mxy) - Var_z*Cov_xy
+
+    x, y = 0.0, A0
+    for i in range(20):
+        Dy = A1 + x*(2*A2 + 3*A3*x)
+        xnew = x - y / Dy
+        if xnew == x or not np.isfinite(xnew):
+            break
+        ynew = A0 + xnew*(A1 + xnew*(A2 + xnew*A3))
+        if abs(ynew) >= abs(y):
+            break
+        x, y = xnew, ynew
+
+    det = x*x - x*Mz + Cov_xy
+    with np.errstate(divide='ignore', invalid='ignore'): # collinear points have no circle: NaN
+        cx = (Mxz*(Myy - x) - Myz*Mxy) / det / 2
+        cy = (Myz*(Mxx - x) - Mxz*Mxy) / det / 2
+    return centroid[0] + cx, centroid[1] + cy, np.sqrt(cx*cx + cy*cy + Mz)
+
+def kasaRows(points):
+    "Rows z = [2x, 2y, 1, x^2 + y^2] of (n, 2) points: the Kasa design matrix with its right hand side appended"
+
+    return np.column_stack((2*points[:,0], 2*points[:,1], np.ones(len(points)), points[:,0]**2 + points[:,1]**2))
+
+class KasaSums:     # Kasa circle fit from running normal-equation sums: O(1) per point, one 3x3 solve per fit
+
+    def __init__(self, window=0, decay=1.0):
+        self.window = window # sweeps kept by addSweep, 0 keeps every sweep
+        self.decay = decay # weight factor applied to the older sweeps by every addSweep, 1.0 for none
+        self.reset()
+
+    def reset(self):
+        self.S = np.zeros((4, 4)) # sum of w z z' over the points; [0:3, 0:3] is A'A, [0:3, 3] is A'B, [3, 3] is B'B
+        self.count = 0 # points in the sums, for the 3 point mandate
+        self.sweeps = collections.deque() # (sums, count) of the sweeps in the window
+
+    def add(self, x, y, w=1.0):
+        "Accumulate one point with weight w"
+
+        z = np.array([2*x, 2*y, 1.0, x*x + y*y])
+        self.S += w * np.outer(z, z)
+        self.count += 1
+
+    def remove(self, x, y, w=1.0):
+        "Take out a point added earlier; w is the weight it has now, i.e. after any decay"
+
+        z = np.array([2*x, 2*y, 1.0, x*x + y*y])
+        self.S -= w * np.outer(z, z)
+        self.count -= 1
+
+    def addSweep(self, points, weights=None):
+        "Age the sums by decay, add one sweep of (n, 2) points and drop the sweep that left the window"
+
+        Z = kasaRows(points)
+        S = np.dot(Z.T, Z) if weights is None else np.dot(Z.T * weights, Z)
+        self.S *= self.decay
+        self.S += S
+        self.count += len(points)
+
+        if self.window:
+            self.sweeps.append((S, len(points)))
+            if len(self.sweeps) > self.window:
+                S, n = self.sweeps.popleft()
+                self.S -= S * self.decay ** self.window # aged once by every addSweep since it was added
+                self.count -= n
+                if self.count == 0:
+                    self.S[:] = 0 # clear the rounding left by the subtractions
+
+    def solve(self):
+        "Circle of the accumulated points: (dx, dy, r, rms radial residual), zeros and a NaN residual below 3 points"
+
+        if self.count < 3:
+            return 0.0, 0.0, 0.0, float('nan')
+        AtB = self.S[0:3, 3]
+        try:
+            x = np.linalg.solve(self.S[0:3, 0:3], AtB)
+        except np.linalg.LinAlgError: # collinear points
+            return 0.0, 0.0, 0.0, float('nan')
+        dx, dy = x[0], x[1]
+        r = np.sqrt(max(x[2] + dx**2 + dy**2, 0.0))
+
+        # the algebraic error of a point d off the circle is about 2 r d; at the solution sum w e^2 = B'B - x'A'B
+        weight = self.S[2, 2]
+        sse = max(self.S[3, 3] - np.dot(x, AtB), 0.0)
+        residual = np.sqrt(sse / weight) / (2 * r) if weight > 0 and r > 0 else float('nan')
+        return dx, dy, r, residual
+
+class GeometricFit:     # orthogonal distance circle fit: Taubin seed, Levenberg-Marquardt refinement from the last solution
+
+    def __init__(self, maxIterations=10, budget=0.002, tolerance=1e-4, clock=time.time):
+        self.maxIterations = maxIterations # LM iterations allowed per fit
+        self.budget = budget # time allowed per fit (s); the fit returns its best solution so far when it runs out
+        self.tolerance = tolerance # step (m) below which the fit has converged
+        self.clock = clock
+        self.last = None # (dx, dy, r) of the last fit, the next fit's starting point
+        self.divergence = 1e3 # a radius or centre this many point spreads away counts as diverged
+        self.iterations = 0 # iterations taken by the last fit
+        self.elapsed = 0.0 # time taken by the last fit (s)
+        self.converged = False
+        self.fits = 0
+        self.totalIterations = 0
+        self.maxElapsed = 0.0
+        self.overBudget = 0 # fits that took longer than the budget, seed included
+        self.unconverged = 0 # fits stopped by the iteration or time bound before converging
+
+    def reset(self):
+        "Forget the warm start; the next fit seeds from Taubin"
+
+        self.last = None
+
+    def fit(self, points):
+        "Circle through (n, 2) points minimising the rms distance to them: (dx, dy, r, rms radial residual)"
+
+        start = self.clock()
+        self.iterations = 0
+        self.converged = False
+        if len(points) < 3: # mandate 3 or more points
+            self.elapsed = self.clock() - start
+            return 0.0, 0.0, 0.0, float('nan')
+
+        c = np.array(self.last if self.last is not None else taubinFit(points), dtype=float)
+        if not np.all(np.isfinite(c)):
+            c = np.array(taubinFit(points), dtype=float)
+        if not np.all(np.isfinite(c)): # collinear points
+            self.last = None
+            self.elapsed = self.clock() - start
+            return 0.0, 0.0, 0.0, float('nan')
+        d, J = self.distances(points, c)
+        cost = np.dot(d, d)
+        lam = 1e-3
+        now = self.clock()
+        tick = now - start # time of the last iteration; seeding costs about as much as one until one has run
+
+        # start an iteration only if it should finish within the budget
+        while self.iterations < self.maxIterations and now - start + tick <= self.budget:
+            self.iterations += 1
+            JtJ = np.dot(J.T, J)
+            try:
+                step = np.linalg.solve(JtJ + lam * np.diag(np.diag(JtJ) + 1e-12), -np.dot(J.T, d))
+            except np.linalg.LinAlgError: # collinear points
+                break
+            dNew, JNew = self.distances(points, c + step)
+            costNew = np.dot(dNew, dNew)
+            improved = costNew < cost
+            if improved:
+                c, d, J, cost = c + step, dNew, JNew, costNew
+                lam *= 0.1
+            if np.sqrt(np.dot(step, step)) < self.tolerance:
+                self.converged = True
+                break
+            if not improved:
+                lam *= 10
+                if lam > 1e6: # no step improves the fit: at the minimum within rounding
+                    self.converged = True
+                    break
+            tick = self.clock() - now
+            now += tick
+
+        # keep the best iterate as the next seed even when unconverged; only a diverged one reseeds from Taubin
+        self.last = None if self.diverged(points, c) else tuple(c)
+        self.elapsed = self.clock() - start
+        self.fits += 1
+        self.totalIterations += self.iterations
+        self.maxElapsed = max(self.maxElapsed, self.elapsed)
+        if self.elapsed > self.budget:
+            self.overBudget += 1
+        if not self.converged:
+            self.unconverged += 1
+        return c[0], c[1], abs(c[2]), np.sqrt(cost / len(points))
+
+    def diverged(self, points, c):
+        "Whether circle c is non-finite, has no radius, or runs off far beyond the points"
+
+        if not np.all(np.isfinite(c)) or c[2] <= 0:
+            return True
+        spread = np.ptp(points, axis=0).max() + self.tolerance
+        return c[2] > self.divergence * spread or np.hypot(*(c[:2] - points.mean(axis=0))) > self.divergence * spread
+
+    def distances(self, points, c):
+        "Signed distance of every point from circle c = (dx, dy, r) and its Jacobian"
+
+        u = points[:,0] - c[0]
+        v = points[:,1] - c[1]
+        rho = np.maximum(np.hypot(u, v), 1e-12)
+        J = np.column_stack((-u / rho, -v / rho, -np.ones(len(points))))
+        return rho - c[2], J
+
+    def stats(self):
+        "Summary of the fits since start"
+
+        return {'fits': self.fits,
+                'mean_iterations': self.totalIterations / float(max(self.fits, 1)),
+                'max_elapsed': self.maxElapsed,
+                'over_budget': self.overBudget,
+                'unconverged': self.unconverged}
+
+class CircleFit:     # least squares circle through the levelled sensor hits (lsqcircle_estimator)
+
+    def __init__(self, offset=QUAD_OFFSET, orient=QUAD_ORIENT, calibration=None, v_min=0.21, v_max=14.0, window=1, decay=1.0,
+                 geometric=None):
+        self.offset = np.asarray(offset, dtype=float)[:, 0:2]
+        self.orient = np.asarray(orient, dtype=float)
+        self.directions = np.column_stack((np.cos(self.orient), np.sin(self.orient)))
+        self.calibration = calibration # calibration.RangeCalibration, or None for raw ranges
+        self.v_min = v_min # validity limits, applied to the uncompensated range
+        self.v_max = v_max
+        self.sensorCount = len(self.orient)
+        self.attitude = None
+        self.operator = np.eye(3)
+        self.sums = KasaSums(window, decay) # fitStream's running sums over the last window sweeps
+        self.geometric = geometric if geometric is not None else GeometricFit() # fitGeometric's bounded, warm started solver
+
+    def projection(self, roll, pitch):
+        "Projection operator for the attitude, recomputed only when it changed"
+
+        if (roll, pitch) != self.attitude:
+            self.attitude = (roll, pitch)
+            self.operator = projectionOperator(roll, pitch)
+        return self.operator
+
+    def valid(self, ranges):
+        ranges = np.asarray(ranges, dtype=float)
+        with np.errstate(invalid='ignore'): # NaN marks an invalid sensor
+            return np.isfinite(ranges) & (ranges >= self.v_min) & (ranges <= self.v_max)
+
+    def vertices(self, ranges):
+        "Body-frame hit point of every sensor, (n, 2)"
+
+        ranges = np.asarray(ranges, dtype=float)
+        if self.calibration is not None:
+            ranges = self.calibration.apply(ranges)
+        return self.offset + ranges[..., None] * self.directions
+
+    def fitVertices(self, vertices, valid, projection):
+        "Circle through the valid body-frame vertices after projecting them with projection"
+
+        points = np.dot(vertices[valid], projection[0:2, 0:2].T) # the vertices' z is 0
+        if len(points) < 3: # mandate 3 or more points
+            return 0.0, 0.0, 0.0, 0.0, float('nan')
+        dx, dy, r, residual = kasaFit(points)
+        return dx, dy, 0.0, r, residual
+
+    def fitStream(self, vertices, valid, projection, weights=None):
+        "fitVertices over the sweeps in the sums' window, each older sweep down-weighted by decay; costs the same for any window"
+
+        points = np.dot(vertices[valid], projection[0:2, 0:2].T)
+        self.sums.addSweep(points, None if weights is None else weights[valid])
+        dx, dy, r, residual = self.sums.solve()
+        return dx, dy, 0.0, r, residual
+
+    def fitGeometric(self, vertices, valid, projection):
+        "fitVertices by orthogonal distance rather than the algebraic Kasa error, unbiased on a partial arc"
+
+        points = np.dot(vertices[valid], projection[0:2, 0:2].T)
+        dx, dy, r, residual = self.geometric.fit(points)
+        return dx, dy, 0.0, r, residual
+
+    def fit(self, ranges, roll, pitch):
+        "Circle centre offset, yaw (always 0 for a circle), radius and rms residual of one sweep"
+
+        return self.fitVertices(self.vertices(ranges), self.valid(ranges), self.projection(roll, pitch))
+
+    def fitBatch(self, ranges, roll, pitch):
+        "fit() of N sweeps at once: (N, n) ranges, (N,) roll and pitch; returns (N, 5) rows of fit() results"
+
+        ranges = np.asarray(ranges, dtype=float)
+        valid = self.valid(ranges)
+        vertices = np.where(valid[..., None], self.vertices(ranges), 0.0)
+        P = projectionOperator(np.asarray(roll, dtype=float), np.asarray(pitch, dtype=float))[:, 0:2, 0:2]
+        points = np.matmul(vertices, np.swapaxes(P, 1, 2)) # (N, n, 2)
+
+        # stacked Kasa normal equations, invalid sensors weighted out
+        w = valid.astype(float)
+        Z = np.stack((2*points[..., 0], 2*points[..., 1], np.ones_like(w), points[..., 0]**2 + points[..., 1]**2), axis=-1)
+        S = np.matmul(np.swapaxes(Z * w[..., None], 1, 2), Z) # kasaRows sums of every sweep
+        AtA = S[:, 0:3, 0:3].copy()
+        AtB = S[:, 0:3, 3:4].copy()
+
+        count = valid.sum(axis=1)
+        ok = count >= 3
+        AtA[~ok] = np.eye(3)
+        AtB[~ok] = 0
+        x = np.linalg.solve(AtA, AtB)[..., 0]
+
+        out = np.zeros((len(ranges), 5))
+        dx, dy = x[:, 0], x[:, 1]
+        r = np.sqrt(np.maximum(x[:, 2] + dx**2 + dy**2, 0))
+        error = (np.hypot(points[..., 0] - dx[:, None], points[..., 1] - dy[:, None]) - r[:, None]) * w
+        out[:, 0] = dx
+        out[:, 1] = dy
+        out[:, 3] = r
+        out[:, 4] = np.sqrt((error**2).sum(axis=1) / np.maximum(count, 1))
+        out[~ok] = [0, 0, 0, 0, np.nan]
+        return out
+
+class LineFit:     # two parallel walls through the levelled sensor hits (lsqline_estimator)
+
+    def __init__(self, offset=QUAD_OFFSET, orient=QUAD_ORIENT, calibration=None, v_min=0.2, v_max=14.0):
+        self.offset = np.asarray(offset, dtype=float)[:, 0:2]
+        self.orient = np.asarray(orient, dtype=float)
+        self.directions = np.column_stack((np.cos(self.orient), np.sin(self.orient)))
+        self.right = (self.orient < 0).astype(float) # sensors looking at the right wall; the rest see the left one
+        self.calibration = calibration # calibration.RangeCalibration, or None for raw ranges
+        self.v_min = v_min # validity limits, applied to the compensated range
+        self.v_max = v_max
+        self.sensorCount = len(self.orient)
+        self.attitude = None
+        self.operator = np.eye(3)
+
+    def projection(self, roll, pitch):
+        "Projection operator for the attitude, recomputed only when it changed"
+
+        if (roll, pitch) != self.attitude:
+            self.attitude = (roll, pitch)
+            self.operator = projectionOperator(roll, pitch)
+        return self.operator
+
+    def compensate(self, ranges):
+        ranges = np.asarray(ranges, dtype=float)
+        return ranges if self.calibration is None else self.calibration.apply(ranges)
+
+    def valid(self, ranges):
+        ranges = self.compensate(ranges)
+        with np.errstate(invalid='ignore'): # NaN marks an invalid sensor
+            return np.isfinite(ranges) & (ranges >= self.v_min) & (ranges <= self.v_max)
+
+    def vertices(self, ranges):
+        "Body-frame hit point of every sensor, (n, 2)"
+
+        return self.offset + self.compensate(ranges)[..., None] * self.directions
+
+    def fitVertices(self, vertices, valid, projection):
+        "Walls through the valid body-frame vertices after projecting them with projection"
+
+        points = np.dot(vertices[valid], projection[0:2, 0:2].T) # the vertices' z is 0
+        if len(points) < 3: # a shared slope and two intercepts
+            return 0.0, 0.0, 0.0, 0.0, float('nan')
+
+        # right wall sensors share the first intercept, left wall sensors the second
+        right = self.right[valid]
+        A = np.column_stack((points[:, 0], -right, right - 1))
+        B = -points[:, 1]
+        x = np.linalg.lstsq(A, B, rcond=-1)[0]
+
+        alpha = np.arctan(x[0])
+        rR = x[1] * np.cos(alpha) # wall distances, perpendicular to the walls
+        rL = x[2] * np.cos(alpha)
+        width = abs(rL) + abs(rR)
+        dy = (width / 2) - rL
+        residual = np.sqrt(np.mean((np.dot(A, x) - B)**2)) * np.cos(alpha)
+        return 0.0, dy, alpha, width / 2, residual
+
+    def fit(self, ranges, roll, pitch):
+        "Lateral offset from the corridor centreline, yaw, half width and rms residual of one sweep; dx is always 0"
+
+        return self.fitVertices(self.vertices(ranges), self.valid(ranges), self.projection(roll, pitch))
+
+class TunnelFit:     # yaw and lateral offset in a tunnel of known radius from two diagonal sensors (geom_estimator)
+
+    def __init__(self, R=2.5, offset=np.pi/4):
+        self.R = R # tunnel radius (m)
+        self.offset = offset # mounting angle of the diagonal sensors
+
+    def fit(self, ranges, roll=0.0, pitch=0.0):
+        "Lateral offset and yaw from the front-left and rear-right ranges; dy is 0, r is the tunnel radius"
+
+        # [[v0, -1], [v1, 1]] x = [R, R], solved in closed form
+        v0, v1 = float(ranges[0]), float(ranges[1])
+        x0 = 2 * self.R / (v0 + v1)
+        dx = self.R - v1 * x0
+        alpha = np.arccos(x0) - self.offset
+        return dx, 0.0, alpha, self.R, 0.0
+
+class PolygonFit:     # centre of the sensor hit polygon and yaw of its front edge (polygon_estimator)
+
+    def __init__(self, orient=(np.pi/4, -3*np.pi/4, -np.pi/4, 3*np.pi/4)):
+        self.orient = np.asarray(orient, dtype=float)
+        self.directions = np.column_stack((np.cos(self.orient), np.sin(self.orient)))
+
+    def fit(self, ranges, roll=0.0, pitch=0.0):
+        "Centre of mass of the hit points, yaw of the sensor 0 to sensor 3 edge, mean radius and its spread"
+
+        v = np.asarray(ranges, dtype=float)[:, None] * self.directions
+        if np.any(np.isinf(v)): # sanity check: an infinite range makes the centre meaningless
+            centre = np.zeros(2)
+        else:
+            centre = v.mean(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            yaw = np.arctan((v[0, 1] - v[3, 1]) / (v[0, 0] - v[3, 0]))
+        radii = np.hypot(v[:, 0] - centre[0], v[:, 1] - centre[1])
+        return centre[0], centre[1], yaw, radii.mean(), radii.std()
+
+if __name__ == "__main__":
+
+    # push synthetic sweeps through the circle fit, one at a time and batched
+    estimator = CircleFit()
+    count = 20000
+    rng = np.random.RandomState(0)
+    centre = rng.uniform(-0.3, 0.3, (count, 2))
+    radius = rng.uniform(1.0, 2.0, count)
+
+    # range along each sensor ray from its mounting point to the circle
+    o = estimator.offset[None] - centre[:, None]
+    d = estimator.directions[None]
+    b = (o * d).sum(axis=2)
+    ranges = -b + np.sqrt(b**2 - (o**2).sum(axis=2) + radius[:, None]**2)
+    ranges += rng.normal(0, 0.01, ranges.shape)
+    ranges[rng.uniform(size=ranges.shape) < 0.05] = np.nan
+    roll = np.zeros(count)
+    pitch = np.zeros(count)
+
+    start = time.time()
+    single = np.array([estimator.fit(ranges[k], roll[k], pitch[k]) for k in range(count)])
+    elapsed = time.time() - start
+    print "fit:      %8.0f sweeps/s" % (count / elapsed)
+
+    start = time.time()
+    batch = estimator.fitBatch(ranges, roll, pitch)
+    elapsed = time.time() - start
+    print "fitBatch: %8.0f sweeps/s" % (count / elapsed)
+
+    print "max difference", np.nanmax(np.abs(single - batch)), "centre error (rms)", np.sqrt(np.mean((batch[:, 0:2] - centre)**2))
+
+    # running sums: the cost per sweep does not grow with the window, and a static circle gains from it
+    valid = estimator.valid(ranges)
+    vertices = estimator.vertices(ranges)
+    P = estimator.projection(0.0, 0.0)
+    for window in (1, 10, 100):
+        stream = CircleFit(window=window)
+        start = time.time()
+        streamed = np.array([stream.fitStream(vertices[k], valid[k], P) for k in range(count)])
+        elapsed = time.time() - start
+        print "fitStream window %3d: %8.0f sweeps/s" % (window, count / elapsed)
+    stream = CircleFit(window=1)
+    streamed = np.array([stream.fitStream(vertices[k], valid[k], P) for k in range(count)])
+    print "window 1 against fit, max centre difference", np.nanmax(np.abs(streamed[:, 0:2] - single[:, 0:2]))
+
+    # geometric fit of a vehicle drifting through a culvert, seen over a partial arc by the forward half of the ring
+    steps = 2000
+    centre = np.cumsum(rng.normal(0, 0.002, (steps, 2)), axis=0)
+    radius = 1.8
+    o = estimator.offset[None] - centre[:, None]
+    b = (o * d).sum(axis=2)
+    ranges = -b + np.sqrt(b**2 - (o**2).sum(axis=2) + radius**2) + rng.normal(0, 0.02, (steps, estimator.sensorCount))
+    ranges[:, 2:4] = np.nan # rear sensors blocked
+    valid = estimator.valid(ranges)
+    vertices = estimator.vertices(ranges)
+    kasa = np.array([estimator.fitVertices(vertices[k], valid[k], P) for k in range(steps)])
+    start = time.time()
+    geometric = np.array([estimator.fitGeometric(vertices[k], valid[k], P) for k in range(steps)])
+    elapsed = time.time() - start
+    print "fitGeometric: %8.0f sweeps/s" % (steps / elapsed), estimator.geometric.stats()
+    print "radius error (mean) kasa", np.mean(kasa[:, 3] - radius), "geometric", np.mean(geometric[:, 3] - radius)
+    print "centre error (rms) kasa", np.sqrt(np.mean((kasa[:, 0:2] - centre)**2)), "geometric", np.sqrt(np.mean((geometric[:, 0:2] - centre)**2))
+
+    # walls of a corridor 2.2 m wide, the vehicle 0.1 m right of its centreline and yawed by 0.1 rad
+    lines = LineFit()
+    yaw = 0.1
+    angle = lines.orient + yaw
+    position = np.dot(lines.offset, [[np.cos(yaw), np.sin(yaw)], [-np.sin(yaw), np.cos(yaw)]]) # mounting points, corridor frame
+    wall = np.where(lines.right > 0, -1.0, 1.2)
+    ranges = (wall - position[:, 1]) / np.sin(angle)
+    print "LineFit:", lines.fit(ranges, 0.0, 0.0), "expected dy -0.1, yaw", yaw, "half width 1.1"
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+import time
+import teraranger
+
+# mraa.I2c compatible stand-in for running the TeraRanger driver without an Edison or sensors.
+# Each address replays a list of recorded events: a 3 byte frame, or an exception that the read raises.
+# Like a TeraRanger One, a sensor takes its next event when the measure register is written; plain reads
+# return that measurement again until the next write, unless the fake is free-running.
+
+MEASURE_REG = teraranger.TeraRangerOne.TRONE_MEASURE_REG
+WHO_AM_I_REG = teraranger.TeraRangerOne.TRONE_WHO_AM_I_REG
+WHO_AM_I_VAL = teraranger.TeraRangerOne.TRONE_WHO_AM_I_VAL
+
+def crc8(msb, lsb):
+    "CRC8 of the two payload bytes, same table as TeraRangerOne.crc8check"
+
+    crcTable = teraranger.TeraRangerOne.crcTable
+    return crcTable[crcTable[msb & 0xFF] ^ (lsb & 0xFF)]
+
+def frame(range):
+    "A valid 3 byte frame for range (mm)"
+
+    msb = (range >> 8) & 0xFF
+    lsb = range & 0xFF
+    return (msb, lsb, crc8(msb, lsb))
+
+def badFrame(range):
+    "A 3 byte frame for range (mm) with a corrupted checksum"
+
+    msb, lsb, crc = frame(range)
+    return (msb, lsb, crc ^ 0xFF)
+
+class FakeI2c:     # replays recorded frames per address, with injectable latency
+
+    def __init__(self, frames=None, latency=0.0, loop=True, sleep=time.sleep, freeRunning=False):
+        self.frames = frames if frames is not None else {} # address -> [frame or Exception, ...]
+        self.latency = latency # seconds per I2C message, or latency(address, op) -> seconds
+        self.loop = loop # start over at the end of a recording, otherwise keep the last event
+        self.sleep = sleep
+        self.selected = None
+        self.freq = None
+        self.freeRunning = freeRunning # every read takes a new measurement, as for firmware that needs no trigger
+        self.position = {}
+        self.current = {} # address -> event of the last measurement
+        self.transactions = 0
+        self.messages = 0 # write or read segments on the wire; a register read is two
+        self.transactionsPerAddress = {}
+
+    @staticmethod
+    def fromLog(path, **kwargs):
+        "Load a recording: one event per line, '<address> <b0> <b1> <b2>' in hex or '<address> error'"
+
+        frames = {}
+        for line in open(path):
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            address = int(line[0], 16)
+            if line[1] == 'error':
+                event = IOError("recorded read failure")
+            else:
+                event = tuple(int(b, 16) for b in line[1:4])
+            frames.setdefault(address, []).append(event)
+
+        return FakeI2c(frames, **kwargs)
+
+    def transaction(self, op, messages=1):
+        "Account for and delay one bus transaction of the given number of messages"
+
+        self.transactions += 1
+        self.messages += messages
+        self.transactionsPerAddress[self.selected] = self.transactionsPerAddress.get(self.selected, 0) + 1
+        latency = self.latency(self.selected, op) if callable(self.latency) else self.latency
+        if latency > 0:
+            self.sleep(latency * messages)
+
+    def measure(self, address):
+        "Start a measurement: the sensor moves on to its next recorded event"
+
+        self.current[address] = self.next(address)
+
+    def result(self, address):
+        "Frame of the last measurement of address; raises it if it is an exception"
+
+        if self.freeRunning or address not in self.current:
+            self.measure(address)
+        event = self.current[address]
+        if isinstance(event, Exception):
+            raise event
+        return bytearray(event)
+
+    def next(self, address):
+        "Next recorded event for address"
+
+        events = self.frames.get(address)
+        if not events:
+            raise IOError("no device at address 0x%x" % (address))
+
+        i = self.position.get(address, 0)
+        if i >= len(events):
+            i = 0 if self.loop else len(events) - 1
+        self.position[address] = i + 1
+        return events[i]
+
+    # mraa.I2c interface
+
+    def frequency(self, mode):
+        self.freq = mode
+        return 0
+
+    def address(self, address):
+        self.selected = address
+        return 0
+
+    def readBytesReg(self, reg, length):
+        self.transaction('readBytesReg', 2) # register write, repeated start, read
+        if reg == WHO_AM_I_REG:
+            if self.selected not in self.frames:
+                raise IOError("no device at address 0x%x" % (self.selected))
+            return bytearray([WHO_AM_I_VAL])
+        if reg == MEASURE_REG:
+            self.measure(self.selected)
+        return self.result(self.selected)[0:length]
+
+    def read(self, length):
+        self.transaction('read')
+        return self.result(self.selected)[0:length]
+
+    def writeByte(self, byte):
+        self.transaction('writeByte')
+        if self.selected not in self.frames:
+            raise IOError("no device at address 0x%x" % (self.selected))
+        if byte == MEASURE_REG:
+            self.measure(self.selected)
+        return 0
+
+    def writeReg(self, reg, byte):
+        self.transaction('writeReg')
+        return 0
+
+    # I2C_RDWR ioctl, for teraranger.I2cDevBus(fd=..., ioctl=fake.ioctl)
+
+    def ioctl(self, fd, request, data):
+        self.selected = None
+        self.transaction('ioctl', data.nmsgs)
+        reg = {}
+        for i in range(data.nmsgs):
+            msg = data.msgs[i]
+            if msg.addr not in self.frames:
+                raise IOError("no device at address 0x%x" % (msg.addr))
+            if not msg.flags & 0x0001: # write: remember the register pointer
+                reg[msg.addr] = msg.buf[0]
+                if msg.buf[0] == MEASURE_REG:
+                    self.measure(msg.addr)
+            elif reg.get(msg.addr) == WHO_AM_I_REG:
+                msg.buf[0] = WHO_AM_I_VAL
+            else: # I2C_M_RD
+                bytes3 = self.result(msg.addr)
+                for j in range(msg.len):
+                    msg.buf[j] = bytes3[j]
+        return 0
+
+if __name__ == "__main__":
+
+    # benchmark the acquisition paths against a 6 sensor ring with 0.25 ms per I2C message
+    addresses = [0x30 + i for i in range(6)]
+    frames = dict((a, [frame(1000 + 10 * i) for i in range(50)] + [badFrame(1000), IOError("replayed")]) for a in addresses)
+    sweeps = 200
+
+    # the fast paths skip the measure register write, so they only get new frames from free-running firmware
+    for name, make, freeRunning in (("mraa", lambda fake: teraranger.TeraRangerBus(addresses=addresses, i2c=fake), False),
+                       ("mraa fast", lambda fake: teraranger.TeraRangerBus(addresses=addresses, i2c=fake, fast=True), True),
+                       ("mraa pipelined", lambda fake: teraranger.TeraRangerBus(addresses=addresses, i2c=fake, pipelined=True), False),
+                       ("i2cdev", lambda fake: teraranger.I2cDevBus(addresses=addresses, fd=-1, ioctl=fake.ioctl), False),
+                       ("i2cdev fast", lambda fake: teraranger.I2cDevBus(addresses=addresses, fd=-1, ioctl=fake.ioctl, fast=True), True)):
+        fake = FakeI2c(frames, latency=0.00025, freeRunning=freeRunning)
+        bus = make(fake)
+        start = time.time()
+        for i in range(sweeps):
+            bus.readRanges()
+        elapsed = time.time() - start
+        print "%-16s %7.1f sweeps/s, %5.2f transactions/sweep, %5.2f messages/sweep" % (name, sweeps / elapsed,
+              float(fake.transactions) / sweeps, float(fake.messages) / sweeps)
+
+    # on a sensor that measures on the register write, the fast path returns the same frame over and over
+    for name, make in (("mraa fast", lambda fake: teraranger.TeraRangerBus(addresses=addresses, i2c=fake, fast=True)),
+                       ("i2cdev fast", lambda fake: teraranger.I2cDevBus(addresses=addresses, fd=-1, ioctl=fake.ioctl, fast=True))):
+        bus = make(FakeI2c(frames))
+        seen = set(tuple(bus.readRanges()) for i in range(20))
+        print "%-16s on triggered sensors: %d distinct sweeps out of 20" % (name, len(seen))
+
+    # a dead sensor fails the combined ioctl; the one by one fallback must quarantine it and keep reading the rest
+    frames = dict((a, [frame(1000 + a)]) for a in addresses)
+    frames[0x33] = [IOError("unplugged")]
+    fake = FakeI2c(frames)
+    bus = teraranger.I2cDevBus(addresses=addresses, fd=-1, ioctl=fake.ioctl)
+    for i in range(bus.RETRY_BUDGET + 1):
+        ranges = bus.readRanges()
+    print "i2cdev fallback: ranges", list(ranges), "quarantined", bus.quarantined()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+import sys
+import argparse
+import numpy as np
+import calibration
+
+# fit the estimators' per-sensor range calibration from a log of raw ranges against reference distances.
+# one sample per line, '<sensor> <raw> <reference>' in metres, whitespace or comma separated; '#' starts a comment
+
+def readLog(path):
+    "Sensor indices, raw ranges and reference distances of every sample in the log"
+
+    sensors = []
+    raw = []
+    reference = []
+    for line in open(path):
+        line = line.split('#')[0].replace(',', ' ').split()
+        if not line:
+            continue
+        sensors.append(int(line[0]))
+        raw.append(float(line[1]))
+        reference.append(float(line[2]))
+
+    return np.array(sensors, dtype=int), np.array(raw), np.array(reference)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Fit per-sensor TeraRanger range calibration from logged samples")
+    parser.add_argument("logs", nargs="+", help="sample logs, '<sensor> <raw> <reference>' per line")
+    parser.add_argument("-o", "--output", default="calibration.json", help="calibration file for the estimators' ~calibration parameter")
+    parser.add_argument("--order", type=int, default=1, help="polynomial order of each sensor's curve (1: gain and offset)")
+    parser.add_argument("--sensors", type=int, default=6, help="number of sensors on the airframe")
+    args = parser.parse_args()
+    if args.order < 1:
+        parser.error("--order must be at least 1")
+
+    samples = [readLog(path) for path in args.logs]
+    sensors = np.concatenate([s[0] for s in samples])
+    raw = np.concatenate([s[1] for s in samples])
+    reference = np.concatenate([s[2] for s in samples])
+
+    if len(sensors) == 0 or sensors.min() < 0 or sensors.max() >= args.sensors:
+        sys.exit("sensor indices must be in 0..%d" % (args.sensors - 1))
+
+    result, rms, counts = calibration.RangeCalibration.fit(sensors, raw, reference, args.sensors, order=args.order)
+
+    for i in range(args.sensors):
+        if np.isnan(rms[i]): # too few finite samples, or too few distinct raw values
+            print "sensor %d: %d samples, left uncorrected" % (i, counts[i])
+        else:
+            print "sensor %d: %d samples, coeffs %s, rms residual %.1f mm" % (i, counts[i],
+                  " ".join("%.5g" % c for c in result.coeffs[i]), 1000 * rms[i])
+
+    result.save(args.output, order=args.order, samples=counts.tolist(),
+                rms=[None if np.isnan(e) else e for e in rms.tolist()])
+    print "wrote", args.output
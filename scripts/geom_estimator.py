@@ -2,6 +2,7 @@
 
 import rospy
 import numpy as np
+import estimators
 
 from std_msgs.msg import Float32
 from sensor_msgs.msg import Range, LaserScan
@@ -20,6 +21,7 @@ class GeomEstimator:     # class constructor; subscribe to topics and advertise
 
         self.R = 2.5 #estimated 2.5m radius tunnel
         self.forwardSpeed = -0.05 #artifically chase a point
+        self.estimator = estimators.TunnelFit(self.R) # the ROS-free fit this node wraps
 
 
         self.v_list = np.array([self.v0, self.v1, self.v2, self.v3])
@@ -79,21 +81,8 @@ class GeomEstimator:     # class constructor; subscribe to topics and advertise
         return np.array([x,y])
 
     def solver(self, v):
-        A = np.array([[v[0], -1],
-            [v[2], 1]])
-
-        B = np.array([[self.R],
-            [self.R]])
-
-        x = np.dot(np.linalg.inv(A), B)
-
-        offset = np.pi/4
-        alpha = np.arccos(x[0]) - offset
-        dx = x[1]
-
-        out = [alpha, dx]
-
-        return out
+        dx, dy, alpha, r, residual = self.estimator.fit([v[0], v[2]]) # v[0] and v[2] are sensors 0 and 1 of v_list
+        return [alpha, dx]
 
     def centroid_pub(self, v, debug = False):
         sol = self.solver(v)
@@ -2,52 +2,60 @@
 
 import rospy
 import numpy as np
+import calibration
+import estimators
 
 from std_msgs.msg import Float32
 from sensor_msgs.msg import Range, LaserScan
 from rospy.numpy_msg import numpy_msg
 from geometry_msgs.msg import PoseStamped, Quaternion, TwistStamped
-from tf.transformations import quaternion_from_euler, euler_from_quaternion, euler_matrix
+from tf.transformations import quaternion_from_euler, euler_from_quaternion
 from teraranger_array.msg import RangeArray
 
 # simple class to contain the node's variables and code
 class CentroidFinder:     # class constructor; subscribe to topics and advertise intent to publish
 
-    def __init__(self, v0 = np.array([1,1]), v1 = np.array([-1,-1]), v2 = np.array([1,-1]), v3 = np.array([-1,1]), v4 = np.array([1,0]), v5 = np.array([-1,0]), debug=False ):
+    def __init__(self, debug=False):
 
-        self.v0 = v0
-        self.v1 = v1
-        self.v2 = v2
-        self.v3 = v3
-        self.v4 = v3
-        self.v5 = v3
         self.debug = debug
-        self.sensorCount = 6
         self.roll = 0
         self.pitch = 0
         self.yaw = 0
-        self.M = np.array([[87, 131, 70, 112.5],
-        [58.5, 94.5, 51, 84],
-        [60.5, 92.5, 52, 84.5],
-        [94, 60.5, 86, 53.5],
-        [91, 57.5, 89.5, 56.5],
-        [141.5, 89.5, 134, 83]])
-        self.M = self.M/100
-
-        self.updated = [False, False, False, False, False, False]
-        self.orient = [-np.pi/4, -np.pi/2, -np.pi/2, np.pi/2, np.pi/2, np.pi/4]
-        self.offset = np.array([[0.2615, -0.154, 0],
-        [0.2130, -0.1690, 0],
-        [-0.2130, -0.1690, 0],
-        [-0.2130, 0.1690, 0],
-        [0.2130, 0.1690, 0],
-        [0.2615, 0.1540, 0]])
+
+        # sensor geometry, one row per sensor so larger rings only need new parameters:
+        # mounting point (m) and pointing angle in the body frame, and the two point calibration table (m)
+        self.offset = np.array(rospy.get_param("~offset", estimators.QUAD_OFFSET.tolist()), dtype=float)
+        self.orient = np.array(rospy.get_param("~orient", estimators.QUAD_ORIENT), dtype=float)
+        self.M = np.array(rospy.get_param("~M", calibration.RANGE_TABLE.tolist()), dtype=float)
+        self.sensorCount = len(self.orient)
+        self.calibration_file = rospy.get_param("~calibration", "") # output of fit_calibration.py; empty uses self.M
+        if self.calibration_file:
+            self.calibration = calibration.RangeCalibration.load(self.calibration_file)
+        else:
+            self.calibration = calibration.RangeCalibration.fromTable(self.M) # compiled once, applied per sweep
+
+        self.vertices = np.zeros((self.sensorCount, 2)) # latest body-frame hit point of every sensor
+        self.updated = np.zeros(self.sensorCount, dtype=bool) # sensors with a new valid vertex since the last fit
+
+        # the fit can run over the last fit_window sweeps, each older sweep weighted down by fit_decay, at the cost of one sweep
+        self.fit_window = rospy.get_param("~fit_window", 1)
+        self.fit_decay = rospy.get_param("~fit_decay", 1.0)
+        self.streaming = self.fit_window != 1 or self.fit_decay != 1.0
+        # "kasa": algebraic fit, "geometric": orthogonal distance fit, unbiased on the partial arcs of a large culvert
+        self.fit = rospy.get_param("~fit", "kasa")
+        geometric = estimators.GeometricFit(maxIterations=rospy.get_param("~fit_iterations", 10),
+                                            budget=rospy.get_param("~fit_budget", 0.002)) # per fit bounds, reported every report_period
+        self.estimator = estimators.CircleFit(self.offset, self.orient, self.calibration,
+                                              window=self.fit_window, decay=self.fit_decay,
+                                              geometric=geometric) # the ROS-free fit this node wraps
+        self.report_period = 5 # seconds between geometric fit reports
+        self.last_report = rospy.get_time()
 
         self.update_rate = 10
+        self.mode = rospy.get_param("~mode", "poll") # "poll": fit at update_rate, "event": fit on every RangeArray
 
-        self.bodyXYZ = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        self.projection = np.eye(3) # body vertices -> levelled points on the tilted sensor plane, see updateProjection
 
-        rospy.Subscriber("teraranger_hub_one", RangeArray, self.updatePolygonVertex, queue_size=1)
         # rospy.Subscriber("teraranger1/laser/scan", LaserScan, self.updatePolygonVertex, 0)
         # rospy.Subscriber("teraranger2/laser/scan", LaserScan, self.updatePolygonVertex, 1)
         # rospy.Subscriber("teraranger3/laser/scan", LaserScan, self.updatePolygonVertex, 2)
@@ -62,46 +70,21 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
         self.errorDp_pub = rospy.Publisher("pitch", Float32, queue_size=1)
 
         rospy.Subscriber("mavros/local_position/pose", PoseStamped, self.updateRPY, queue_size=1)
+        # subscribed last: in event mode the callback publishes, so the publishers must exist first
+        rospy.Subscriber("teraranger_hub_one", RangeArray, self.updatePolygonVertex, queue_size=1)
+
+        if self.mode == "event":
+            rospy.spin() # the fit runs in updatePolygonVertex, as soon as a sweep arrives
+            return
 
         rate = rospy.Rate(self.update_rate)
 
         while not rospy.is_shutdown():
             # if (self.updated[0]==True and self.updated[1]==True and self.updated[2]==True and self.updated[3]==True):
-            self.bodyXYZ = self.bodyRotation(-self.pitch, -self.roll) #update the body rotation matrix
-            #self.bodyXYZ = self.bodyRotation(-0, -np.pi/6)
+            self.updateProjection() #update the body rotation matrix and projection if the attitude changed
             self.lsqcircle_pub()
             rate.sleep()
 
-    def sensorComp(self, old, i):
-        M = self.M
-        A = np.array([[M[i,0], 1],[M[i,1], 1]])
-        Y = np.array([M[i,2], M[i,3]])
-        X = np.dot(np.linalg.inv(A),Y)
-        new = X[0]*old + X[1]
-        return new
-
-    def bodyRotation(self, pitch, roll, debug=False):
-        bodyXYZ = np.array([[1, 0, 0, 0],[0, 1, 0, 0],[0, 0, 1, 0], [0, 0, 0, 1]])
-        rotmZ = euler_matrix(0,0,0,'sxyz')
-        bodyX1Y1Z1 = np.dot(rotmZ, bodyXYZ)
-        # bodyX1Y1Z1 = rotmZ * bodyXYZ
-        rotmY = euler_matrix(0,pitch,0,'sxyz') #-pitch because px4 y-axis points to the left.
-        bodyX2Y2Z2 = np.dot(rotmY, bodyX1Y1Z1)
-        # bodyX2Y2Z2 = rotmY * bodyX1Y1Z1
-        rotmX = euler_matrix(roll,0,0,'sxyz')
-        bodyX3Y3Z3 = np.dot(rotmX, bodyX2Y2Z2)
-        # bodyX3Y3Z3 = rotmX * bodyX2Y2Z2
-
-        if debug or self.debug:
-            print 'bodyX1Y1Z1 ', bodyX1Y1Z1
-            print 'bodyX2Y2Z2 ', bodyX2Y2Z2
-            print 'bodyX3Y3Z3 ', bodyX3Y3Z3
-            print 'rotmZ ', rotmZ
-            print 'rotmY ', rotmY
-            print 'rotmX ', rotmX
-
-        return bodyX3Y3Z3
-
     def updateRPY(self, data, debug=False):
         local_position = data
         q = local_position.pose.orientation
@@ -115,145 +98,62 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
             print 'roll ', self.roll, '\t pitch ', self.pitch, '\t yaw ', -(euler[2]-np.pi/2)
 
     def updatePolygonVertex(self, msg, debug=False):
-        ranges = msg.ranges
-        for i in range(self.sensorCount):
-            v = ranges[i].range
-            if (debug):
-                print 'teraranger' , i, 'distance ', v
-            v = self.sensorComp(v,i)
-            self.updatePolygonVertex_old([v, ranges[i].range], i)
-
-    def updatePolygonVertex_old(self, msg, index, debug=False):
-        v = msg[0]
-        v_old = msg[1]
-        #print v_old
-        v_min = 210.0/1000.0
-        v_max = 14.0
-        valid = True
-        if (v_old < v_min or v_old > v_max): #use the pre-compensated value to check validity
-            valid = False
-            #print 'False'
-        if (index == 0 and valid):
-            self.v0 = self.offset[0, 0:2] + self.rotate(v, self.orient[0])
-            self.updated[0] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v0
-        elif (index == 1 and valid):
-            self.v1 = self.offset[index, 0:2] + self.rotate(v, self.orient[1])
-            self.updated[1] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v1
-        elif (index == 2 and valid):
-            self.v2 = self.offset[index, 0:2] + self.rotate(v, self.orient[2])
-            self.updated[2] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v2
-        elif (index == 3 and valid):
-            self.v3 = self.offset[index, 0:2] + self.rotate(v, self.orient[3])
-            self.updated[3] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v3
-        elif (index == 4 and valid):
-            self.v4 = self.offset[index, 0:2] + self.rotate(v, self.orient[4])
-            self.updated[4] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v4
-        elif (index == 5 and valid):
-            self.v5 = self.offset[index, 0:2] + self.rotate(v, self.orient[5])
-            self.updated[5] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v5
-
-    def rotate(self, r, angle):
-        x = r * np.cos(angle)
-        y = r * np.sin(angle)
-
-        return np.array([x,y])
-
-    def projectSubspace(self, A, B, debug=False):
-        x = np.linalg.lstsq(A,B)[0]
-        v = np.dot(A, x)
+        raw = np.array([msg.ranges[i].range for i in range(self.sensorCount)])
+        valid = self.estimator.valid(raw) # use the pre-compensated value to check validity, NaN marks an invalid sensor
+        self.vertices[valid] = self.estimator.vertices(raw)[valid] # the whole sweep in one pass, invalid sensors keep their last vertex
+        self.updated |= valid
         if (debug):
-            print 'A: ', A
-            print 'B: ', B
-            print 'x: ', x
-            print 'v: ', v
-        return v
+            print 'teraranger distance ', raw
+            print 'teraranger vertex ', self.vertices
+
+        if self.mode == "event":
+            self.updateProjection()
+            self.lsqcircle_pub()
+
+    def updateProjection(self):
+        "Fetch the vertex projection operator; the estimator only recomputes it when roll or pitch changed"
+
+        self.projection = self.estimator.projection(self.roll, self.pitch)
+
+    def reportFit(self):
+        "Log the geometric fit's iteration count and time against its bounds, every report_period"
+
+        if rospy.get_time() - self.last_report < self.report_period:
+            return
+        stats = self.estimator.geometric.stats()
+        rospy.loginfo("circle fit: %d fits, %.2f iterations (max %d), %.2f ms max (budget %.2f ms), %d over budget, %d unconverged",
+                      stats['fits'], stats['mean_iterations'], self.estimator.geometric.maxIterations,
+                      1000 * stats['max_elapsed'], 1000 * self.estimator.geometric.budget, stats['over_budget'],
+                      stats['unconverged'])
+        self.last_report = rospy.get_time()
 
     def lsqcircle_pub(self, debug = False):
-        rotm = euler_matrix(self.roll, self.pitch, 0, 'sxyz')
-        #rotm = euler_matrix(np.pi/6, 0, 0, 'sxyz')
-        A = self.bodyXYZ[0:3, 0:2]
-        updated = np.copy(self.updated) # lock the current updated matrix using shallow copy
-        vs = np.array([[self.v0[0], self.v0[1], 0], # lock in all the vertices
-        [self.v1[0], self.v1[1], 0],
-        [self.v2[0], self.v2[1], 0],
-        [self.v3[0], self.v3[1], 0],
-        [self.v4[0], self.v4[1], 0],
-        [self.v5[0], self.v5[1], 0]])
+        projection = self.projection
+        updated = self.updated.copy() # lock in the current updated mask and vertices
+        vs = self.vertices.copy()
         trues = np.sum(updated)
-        Alsq = np.zeros((trues,3))
-        Blsq = np.zeros((trues,1))
-        array_index = 0
         if (debug):
             print 'updated: ', updated
             print 'trues: ', trues
-            # print 'A', A
-            # print 'rotm', rotm
-
-
-        for index in range(self.sensorCount):
-            B = vs[index, :]
-            v = self.projectSubspace(A,B)
-            v = np.dot(rotm[0:3,0:3], v)
-            if (debug):
-                print 'updated[', index, ']: ', updated[index]
-            if (updated[index]):
-                Alsq[array_index, :] = [2*v[0], 2*v[1], 1]
-                Blsq[array_index, :] = [v[0]**2+v[1]**2]
-                array_index += 1
-            if (debug):
-                print 'v', 'index', ': ', v
-                print "A: ", Alsq
-                print "B: ", Blsq
-
-        # reset all after consumption
-        self.updated[0] = False
-        self.updated[1] = False
-        self.updated[2] = False
-        self.updated[3] = False
-        self.updated[4] = False
-        self.updated[5] = False
-
-        # At = A.transpose()
-        #
-        # x = np.dot(np.linalg.inv(np.dot(At, A)), np.dot(At, B))
-        # print "A: ", Alsq
-        # print "B: ", Blsq
-
-        if (np.sum(Alsq) != 0 and np.sum(Blsq) != 0 and trues >=3): #mandate 3 or more points to publish
-            x = np.linalg.lstsq(Alsq,Blsq)[0];
-            dx = x[0]
-            dy = x[1]
-            r  = np.sqrt(x[2]+dx**2+dy**2)
-            alpha = 0
+
+        self.updated[:] = False # reset all after consumption
+
+        if self.fit == "geometric":
+            dx, dy, alpha, r, residual = self.estimator.fitGeometric(vs, updated, projection) # warm started from the last fit
+            self.reportFit()
+        elif self.streaming:
+            dx, dy, alpha, r, residual = self.estimator.fitStream(vs, updated, projection) # running sums over the window
         else:
-            dx = 0
-            dy = 0
-            r  = 0
-            alpha = 0
+            dx, dy, alpha, r, residual = self.estimator.fitVertices(vs, updated, projection) # zeros below 3 points
 
         if self.debug or debug:
             print 'dX: \t', dx
             print 'dY: \t', dy
             print 'r: \t', r
             print 'trues: \t', trues
+            print 'residual: \t', residual
+            if self.fit == "geometric":
+                print 'iterations: \t', self.estimator.geometric.iterations, '\t elapsed: \t', self.estimator.geometric.elapsed
             # print 'A: \t', A
             # print 'B: \t', B
             # print 'x: \t', x
@@ -267,17 +167,3 @@ if __name__ == "__main__":
 
     rospy.init_node("centroid_finder_node")
     node = CentroidFinder()
-
-    #rospy.spin()
-
-    # v1 = 1.5
-    # v2 = 2
-    # v3 = 0.5
-    # node = CentreFinder(v1, v2, v3)
-    # node.v1 = node.rotate(node.v1, node.orient[0])
-    # print node.v1
-    # node.v2 = node.rotate(node.v2, node.orient[1])
-    # print node.v2
-    # node.v3 = node.rotate(node.v3, node.orient[2])
-    # print node.v3
-    # print node.error()
@@ -2,6 +2,7 @@
 
 import rospy
 import numpy as np
+import estimators
 
 from std_msgs.msg import Float32
 from sensor_msgs.msg import Range, LaserScan
@@ -23,6 +24,8 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
         self.updated = [False, False, False, False]
         self.orient = [np.pi/4, -3*np.pi/4, -np.pi/4, 3*np.pi/4]
         self.update_rate = 100
+        self.ranges = np.array([np.hypot(*v) for v in (v0, v1, v2, v3)]) # raw range of each sensor, for the estimator
+        self.estimator = estimators.PolygonFit(self.orient) # the ROS-free fit this node wraps
 
         rospy.Subscriber("teraranger1/laser/scan", LaserScan, self.updatePolygonVertex, 0)
         rospy.Subscriber("teraranger2/laser/scan", LaserScan, self.updatePolygonVertex, 1)
@@ -43,6 +46,7 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
 
     def updatePolygonVertex(self, msg, index):
         v = msg.ranges[0]
+        self.ranges[index] = v
         if index == 0:
             self.v0 = self.rotate(v, self.orient[0])
             self.updated[0] = True
@@ -128,8 +132,8 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
     def centroid_pub(self, v):
         area = self.area(v)
         # centre = self.centroid(v, area)
-        centre = self.centre_of_mass(v)
-        yaw = self.yaw()
+        dx, dy, yaw, r, residual = self.estimator.fit(self.ranges) # centre of mass and yaw of the v0-v3 edge
+        centre = np.array([dx, dy])
 
         self.updated[0] = False
         self.updated[1] = False
@@ -1,8 +1,13 @@
 #!/usr/bin/python
 
+import os
+import sys
 import rospy
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)) # shared modules live in scripts/
+import calibration
+
 from std_msgs.msg import Float32
 from sensor_msgs.msg import Range, LaserScan
 from rospy.numpy_msg import numpy_msg
@@ -13,45 +18,41 @@ from teraranger_array.msg import RangeArray
 # simple class to contain the node's variables and code
 class CentroidFinder:     # class constructor; subscribe to topics and advertise intent to publish
 
-    def __init__(self, v0 = np.array([1,1]), v1 = np.array([-1,-1]), v2 = np.array([1,-1]), v3 = np.array([-1,1]), v4 = np.array([1,0]), v5 = np.array([-1,0]), debug=False ):
+    def __init__(self, debug=False):
 
-        self.v0 = v0
-        self.v1 = v1
-        self.v2 = v2
-        self.v3 = v3
-        self.v4 = v3
-        self.v5 = v3
         self.debug = debug
         self.roll = 0
         self.pitch = 0
-        self.M = np.array([[87, 131, 70, 112.5],
-        [58.5, 94.5, 51, 84],
-        [60.5, 92.5, 52, 84.5],
-        [94, 60.5, 86, 53.5],
-        [91, 57.5, 89.5, 56.5],
-        [141.5, 89.5, 134, 83]])
-        self.M = self.M/100;
-
-        self.updated = [False, False, False, False, False, False]
-        self.orient = [-np.pi/4, -np.pi/2, -np.pi/2, np.pi/2, np.pi/2,  np.pi/4]
-        self.offset = np.array([[0.2256, -0.1741, 0],
+
+        # sensor geometry, one row per sensor so larger rings only need new parameters:
+        # mounting point (m) and pointing angle in the body frame, and the two point calibration table (m)
+        self.offset = np.array(rospy.get_param("~offset", [[0.2256, -0.1741, 0],
         [0.1739, -0.1915, 0],
         [-0.1739, -0.1915, 0],
         [-0.1739, 0.1915, 0],
         [0.1739, 0.1915, 0],
-        [0.2256, 0.1741, 0]])
+        [0.2256, 0.1741, 0]]), dtype=float)
+        self.orient = np.array(rospy.get_param("~orient", [-np.pi/4, -np.pi/2, -np.pi/2, np.pi/2, np.pi/2, np.pi/4]), dtype=float)
+        self.M = np.array(rospy.get_param("~M", calibration.RANGE_TABLE.tolist()), dtype=float)
+        self.sensorCount = len(self.orient)
+        self.directions = np.column_stack((np.cos(self.orient), np.sin(self.orient)))
+        self.calibration_file = rospy.get_param("~calibration", "") # output of fit_calibration.py; empty uses self.M
+        if self.calibration_file:
+            self.calibration = calibration.RangeCalibration.load(self.calibration_file)
+        else:
+            self.calibration = calibration.RangeCalibration.fromTable(self.M) # compiled once, applied per sweep
+
+        self.vertices = self.offset[:, 0:2] + self.directions # latest body-frame hit point of every sensor, 1 m out until measured
+        self.updated = np.zeros(self.sensorCount, dtype=bool) # sensors with a new valid vertex since the last fit
+        self.right = self.orient < 0 # sensors looking at the right wall; the rest see the left one
 
         self.update_rate = 10
 
         self.bodyXYZ = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
 
         # rospy.Subscriber("teraranger_hub_one", RangeArray, self.updatePolygonVertex, queue_size=1)
-        rospy.Subscriber("teraranger1/laser/scan", LaserScan, self.updatePolygonVertex_old, 0)
-        rospy.Subscriber("teraranger2/laser/scan", LaserScan, self.updatePolygonVertex_old, 1)
-        rospy.Subscriber("teraranger3/laser/scan", LaserScan, self.updatePolygonVertex_old, 2)
-        rospy.Subscriber("teraranger4/laser/scan", LaserScan, self.updatePolygonVertex_old, 3)
-        rospy.Subscriber("teraranger5/laser/scan", LaserScan, self.updatePolygonVertex_old, 4)
-        rospy.Subscriber("teraranger6/laser/scan", LaserScan, self.updatePolygonVertex_old, 5)
+        for i in range(self.sensorCount):
+            rospy.Subscriber("teraranger%d/laser/scan" % (i + 1), LaserScan, self.updatePolygonVertex_old, i)
 
         self.errorDx_pub = rospy.Publisher("error_dx", Float32, queue_size=1)
         self.errorDy_pub = rospy.Publisher("error_dy", Float32, queue_size=1)
@@ -70,14 +71,6 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
             self.lsqline_pub()
             rate.sleep()
 
-    def sensorComp(self, old, i):
-        M = self.M
-        A = np.array([[M[i,0], 1],[M[i,1], 1]])
-        Y = np.array([M[i,2], M[i,3]])
-        X = np.dot(np.linalg.inv(A),Y)
-        new = X[0]*old + X[1]
-        return new
-
     def bodyRotation(self, pitch, roll, debug=False):
         bodyXYZ = np.array([[1, 0, 0, 0],[0, 1, 0, 0],[0, 0, 1, 0], [0, 0, 0, 1]])
         rotmZ = euler_matrix(0,0,0,'sxyz')
@@ -113,58 +106,28 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
             print 'roll ', self.roll, '\t pitch ', self.pitch, '\t yaw ', -(euler[2]-np.pi/2)
 
     def updatePolygonVertex(self, msg, debug=False):
-        ranges = msg.ranges
-        sensorCount = 6
-        for i in range(sensorCount):
-            v = ranges[i].range
-            if (debug):
-                print 'teraranger' , i, 'distance ', v
-            v = self.sensorComp(v,i)
-            self.updatePolygonVertex_old(v, i)
+        v = self.calibration.apply([msg.ranges[i].range for i in range(self.sensorCount)]) # the whole sweep in one pass
+        v_min = 200.0/1000.0
+        v_max = 14.0
+        with np.errstate(invalid='ignore'): # NaN marks an invalid sensor
+            valid = (v >= v_min) & (v <= v_max)
+        self.vertices[valid] = self.offset[valid, 0:2] + v[valid, None] * self.directions[valid]
+        self.updated |= valid
+        if (debug):
+            print 'teraranger distance ', v
+            print 'teraranger vertex ', self.vertices
 
     def updatePolygonVertex_old(self, msg, index, debug=False):
-        # v = msg
-        v = msg.ranges[0]
-        v_min = 200/1000
-        v_max = 14
-        if (v < v_min or v > v_max):
-            return False
-        if index == 0:
-            self.v0 = self.offset[0, 0:2] + self.rotate(v, self.orient[0])
-            self.updated[0] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v0
-        elif index == 1:
-            self.v1 = self.offset[index, 0:2] + self.rotate(v, self.orient[1])
-            self.updated[1] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v1
-        elif index == 2:
-            self.v2 = self.offset[index, 0:2] + self.rotate(v, self.orient[2])
-            self.updated[2] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v2
-        elif index == 3:
-            self.v3 = self.offset[index, 0:2] + self.rotate(v, self.orient[3])
-            self.updated[3] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v3
-        elif index == 4:
-            self.v4 = self.offset[index, 0:2] + self.rotate(v, self.orient[4])
-            self.updated[4] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v4
-        elif index == 5:
-            self.v5 = self.offset[index, 0:2] + self.rotate(v, self.orient[5])
-            self.updated[5] = True
-            if debug == True:
-                print '\n teraranger: ', index, '\t distance: ', v
-                print '\n teraranger: ', index, '\t distance: ', self.v5
+        v = msg.ranges[0] # one simulated sensor per LaserScan
+        v_min = 200.0/1000.0
+        v_max = 14.0
+        if (not (v >= v_min and v <= v_max)):
+            return
+        self.vertices[index] = self.offset[index, 0:2] + v * self.directions[index]
+        self.updated[index] = True
+        if debug == True:
+            print '\n teraranger: ', index, '\t distance: ', v
+            print '\n teraranger: ', index, '\t vertex: ', self.vertices[index]
 
     def rotate(self, r, angle):
         x = r * np.cos(angle)
@@ -191,79 +154,21 @@ class CentroidFinder:     # class constructor; subscribe to topics and advertise
             #print 'A', A
             #print 'rotm', rotm
 
-        B = np.array([self.v0[0], self.v0[1], 0])
+        B = np.column_stack((self.vertices, np.zeros(self.sensorCount))).T # one column per vertex
         #if (debug):
             #print 'B', B
 
-        v0 = self.projectSubspace(A, B)
-        v0 = np.dot(rotm[0:3,0:3], v0)
+        v = self.projectSubspace(A, B) # every vertex in one least squares solve
+        v = np.dot(rotm[0:3,0:3], v)
         if (debug):
-            print 'v0', v0
+            print 'v', v.T
 
-        B = np.array([self.v1[0], self.v1[1], 0])
-        v1 = self.projectSubspace(A, B)
-        v1 = np.dot(rotm[0:3,0:3], v1)
-        if (debug):
-            print 'v1', v1
-
-        B = np.array([self.v2[0], self.v2[1], 0])
-        v2 = self.projectSubspace(A, B)
-        v2 = np.dot(rotm[0:3,0:3], v2)
-        if (debug):
-            print 'v2', v2
+        # right wall sensors share the first intercept, left wall sensors the second
+        right = self.right.astype(float)
+        A = np.column_stack((v[0], -right, right - 1))
+        B = -v[1].reshape(self.sensorCount, 1)
 
-        B = np.array([self.v3[0], self.v3[1], 0])
-        v3 = self.projectSubspace(A, B)
-        v3 = np.dot(rotm[0:3,0:3], v3)
-        if (debug):
-            print 'v3', v3
-
-        B = np.array([self.v4[0], self.v4[1], 0])
-        v4 = self.projectSubspace(A, B)
-        v4 = np.dot(rotm[0:3,0:3], v4)
-        if (debug):
-            print 'v4', v4
-
-        B = np.array([self.v5[0], self.v5[1], 0])
-        v5 = self.projectSubspace(A, B)
-        v5 = np.dot(rotm[0:3,0:3], v5)
-        if (debug):
-            print 'v5', v5
-
-        A = np.array([[v0[0], -1, 0],
-        [v1[0], -1, 0],
-        [v2[0], -1, 0],
-        [v3[0], 0, -1],
-        [v4[0], 0, -1],
-        [v5[0], 0, -1]])
-
-        B = np.array([[-v0[1]],
-        [-v1[1]],
-        [-v2[1]],
-        [-v3[1]],
-        [-v4[1]],
-        [-v5[1]]])
-
-        # A = np.array([[self.v0[0], -1, 0],
-        # [self.v1[0], -1, 0],
-        # [self.v2[0], -1, 0],
-        # [self.v3[0], 0, -1],
-        # [self.v4[0], 0, -1],
-        # [self.v5[0], 0, -1]])
-        #
-        # B = np.array([[-self.v0[1]],
-        # [-self.v1[1]],
-        # [-self.v2[1]],
-        # [-self.v3[1]],
-        # [-self.v4[1]],
-        # [-self.v5[1]]])
-
-        self.updated[0] = False
-        self.updated[1] = False
-        self.updated[2] = False
-        self.updated[3] = False
-        self.updated[4] = False
-        self.updated[5] = False
+        self.updated[:] = False
 
         # At = A.transpose()
         #
@@ -1,7 +1,17 @@
 #!/usr/bin/python
 
-import mraa as m
-import rospy
+import os
+import json
+import bisect
+import time
+import fcntl
+import ctypes
+import numpy as np
+
+try:
+    import mraa as m
+except ImportError:
+    m = None # off the Edison: pass an mraa.I2c compatible handle, e.g. fake_i2c.FakeI2c, as i2c=
 
 # simple class to contain the node's variables and code
 
@@ -17,6 +27,7 @@ class TeraRangerOne:     # class constructor; subscribe to topics and advertise
     # Device Limits
     TRONE_MIN_DISTANCE = 0.20
     TRONE_MAX_DISTANCE = 14.00
+    TRONE_RANGING_TIME = 0.001 # seconds between triggering a measurement and reading it back
 
     # MRAA I2C bus frequency modes. These enums should probably be picked up from a header file.
     I2C_STD = 0
@@ -46,18 +57,24 @@ class TeraRangerOne:     # class constructor; subscribe to topics and advertise
 	0xde, 0xd9, 0xd0, 0xd7, 0xc2, 0xc5, 0xcc, 0xcb, 0xe6, 0xe1, 0xe8, 0xef,
 	0xfa, 0xfd, 0xf4, 0xf3)
 
-    def __init__(self, bus=1, address=TRONE_BASEADDR, debug=False, freq=I2C_STD):
-        self.x = m.I2c(bus) #, raw=True) # forces manual bus selection, vs. board default
+    def __init__(self, bus=1, address=TRONE_BASEADDR, debug=False, freq=I2C_STD, i2c=None, fast=False):
+        self.x = i2c if i2c is not None else m.I2c(bus) #, raw=True) # forces manual bus selection, vs. board default
         self.address = address
+        # skip the measure register write once the pointer is on it; only for firmware that starts a new
+        # measurement on every plain read: a TeraRanger One measures on the write and would return its last frame
+        self.fast = fast
+        self.pointerSet = False
         self.x.frequency(freq) # default to I2C_STD (up to 100kHz). Other options: I2C_FAST (up to 400kHz), I2C_HIGH (up to 3.4Mhz)
         self.x.address(self.address) # address of the TeraRanger sensor
         self.debug = debug
-        if self.debug:
+        if self.debug and m is not None:
             print m.printError(self.x.address(address))
 
     def probe(self, deb=False):
         "Probing TeraRanger "
 
+        self.pointerSet = False # reading WHO_AM_I moves the register pointer
+
         try:
             byte = self.x.readBytesReg(self.TRONE_WHO_AM_I_REG, 1)
         except:
@@ -79,29 +96,74 @@ class TeraRangerOne:     # class constructor; subscribe to topics and advertise
     def readRangeData(self, deb=False):
         "Read 3 byte distance bytes from the sensor"
 
-        try:
-            bytes3 = self.x.readBytesReg(self.TRONE_MEASURE_REG, 3)
-        except:
-            if self.debug or deb:
-                print "TROne readRangeData readBytesReg failed"
-            #return -256 # I2C read error
-            bytes3 = [0,1,0]
+        bytes3 = None
+
+        if self.fast and self.pointerSet:
+            try:
+                bytes3 = self.x.read(3) # plain read: the pointer still addresses the measure register
+            except:
+                if self.debug or deb:
+                    print "TROne readRangeData fast read failed, re-reading the register"
+                self.pointerSet = False
+
+        if bytes3 is None:
+            try:
+                bytes3 = self.x.readBytesReg(self.TRONE_MEASURE_REG, 3)
+                self.pointerSet = True
+            except:
+                if self.debug or deb:
+                    print "TROne readRangeData readBytesReg failed"
+                #return -256 # I2C read error
+                bytes3 = [0,1,0]
+                self.pointerSet = False
 
         MSB = bytes3[0]
         LSB = bytes3[1]
         range = MSB << 8 | LSB
 
-        crc = self.crc8check((MSB,LSB), deb=deb)
+        crc = crc16Table[range] # CRC8 of both payload bytes in one lookup
 
         if self.debug or deb:
             print "sent crc8: ", bytes3[2], "crc8check: ", crc
 
-        if (str(crc) == str(bytes3[2])):
+        if crc == bytes3[2]:
             if self.debug or deb:
                 print "trone (address = 0x%x) ranged %2d mm" % (self.address, range)
             return range
         else:
             # return -255 # bad checksum
+            self.pointerSet = False # the next read re-writes the register, in case the pointer moved
+            return 1
+
+    def triggerRange(self, deb=False):
+        "Start a measurement without waiting for the result"
+
+        try:
+            self.x.writeByte(self.TRONE_MEASURE_REG)
+        except:
+            if self.debug or deb:
+                print "TROne triggerRange writeByte failed"
+            self.pointerSet = False
+            return False
+
+        self.pointerSet = True
+        return True
+
+    def collectRange(self, deb=False):
+        "Read back the 3 byte result of a measurement started by triggerRange"
+
+        try:
+            bytes3 = self.x.read(3)
+        except:
+            if self.debug or deb:
+                print "TROne collectRange read failed"
+            return 1
+
+        range = bytes3[0] << 8 | bytes3[1]
+
+        if crc16Table[range] == bytes3[2]:
+            return range
+        else:
             return 1
 
     def changeNewAddr(self, newAddr, deb=False):
@@ -135,6 +197,704 @@ class TeraRangerOne:     # class constructor; subscribe to topics and advertise
 
         return result
 
+def makeCrc16Table(crcTable):
+    "CRC8 of every two byte payload, indexed by (MSB << 8 | LSB)"
+
+    table = np.array(crcTable, dtype=np.uint8)
+    crc = table[table[:, None] ^ np.arange(256, dtype=np.uint8)[None, :]] # [MSB, LSB]
+    return bytearray(crc.tobytes())
+
+crc16Table = makeCrc16Table(TeraRangerOne.crcTable) # bytearray: fast scalar lookups
+crc16Array = np.frombuffer(crc16Table, dtype=np.uint8) # numpy view of the same table for batches
+
+def validateFrames(frames):
+    "Check an (N, 3) array of raw frames at once; returns the ranges (mm) and a mask of valid checksums"
+
+    frames = np.asarray(frames, dtype=np.uint8).reshape(-1, 3)
+    ranges = frames[:, 0].astype(np.int32) << 8 | frames[:, 1]
+    valid = crc16Array[ranges] == frames[:, 2]
+    return ranges, valid
+
+def loadBusCache(path):
+    "Per-bus values (discovered addresses, calibrated frequency) saved by saveBusCache; empty if there is no usable cache"
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def saveBusCache(path, bus, value):
+    "Store the value of one bus, keeping the other buses' entries"
+
+    cache = loadBusCache(path)
+    cache[str(bus)] = value
+
+    try:
+        with open(path, 'w') as f:
+            json.dump(cache, f)
+    except IOError:
+        pass # no cache only costs a full scan on the next boot
+
+# outcome of a sensor's last read, as kept in TeraRangerBus.status and RangeRing
+READ_OK = 0
+READ_CRC = 1 # frame received with a bad checksum
+READ_ERROR = 2 # bus error (NAK, timeout) on the transaction
+READ_SKIPPED = 3 # quarantined, or not read yet
+
+class ReadStats:     # per-sensor transaction latency histograms and failure counts
+
+    # histogram bin edges (seconds): 0, then 0.1 ms to 100 ms at four bins per decade; the last bin is open
+    LATENCY_EDGES = [0.0] + list(np.logspace(-4, -1, 13))
+
+    def __init__(self, sensorCount):
+        n = sensorCount
+        self.histogram = np.zeros((n, len(self.LATENCY_EDGES)), dtype=np.int64) # bin j: [edge j, edge j + 1)
+        self.reads = np.zeros(n, dtype=np.int64) # transactions attempted
+        self.crcErrors = np.zeros(n, dtype=np.int64)
+        self.busErrors = np.zeros(n, dtype=np.int64) # exceptions from the I2C backend
+        self.maxLatency = np.zeros(n)
+
+    def record(self, index, status, latency):
+        "Account for one read of the sensor at position index"
+
+        if status == READ_SKIPPED:
+            return # quarantined: no transaction took place
+        self.reads[index] += 1
+        if status == READ_CRC:
+            self.crcErrors[index] += 1
+        elif status == READ_ERROR:
+            self.busErrors[index] += 1
+        self.histogram[index, bisect.bisect_right(self.LATENCY_EDGES, latency) - 1] += 1
+        if latency > self.maxLatency[index]:
+            self.maxLatency[index] = latency
+
+    def percentile(self, index, q):
+        "Upper edge of the histogram bin holding the q-th percentile latency of a sensor (seconds)"
+
+        counts = np.cumsum(self.histogram[index])
+        if counts[-1] == 0:
+            return 0.0
+        j = int(np.searchsorted(counts, q / 100.0 * counts[-1]))
+        return self.LATENCY_EDGES[j + 1] if j + 1 < len(self.LATENCY_EDGES) else self.maxLatency[index]
+
+class RangeRing:     # preallocated history of raw sweeps, exported as numpy views without copying
+
+    def __init__(self, capacity, ids):
+        n = len(ids)
+        self.capacity = capacity
+        self.ids = np.array(ids, dtype=np.uint8) # I2C address of each column
+        # every row is written twice, at k and k + capacity, so any run of the last N rows is contiguous
+        self.ranges = np.ones((2 * capacity, n), dtype=np.int32)
+        self.stamps = np.zeros((2 * capacity, n))
+        self.status = np.full((2 * capacity, n), READ_SKIPPED, dtype=np.uint8)
+        self.count = 0 # sweeps appended so far
+
+    def append(self, ranges, stamps, status):
+        "Store one sweep, overwriting the oldest once the ring is full"
+
+        k = self.count % self.capacity
+        for row in (k, k + self.capacity):
+            self.ranges[row] = ranges
+            self.stamps[row] = stamps
+            self.status[row] = status
+        self.count += 1
+
+    def last(self, n=None):
+        "Views (ranges, stamps, status) of the last n sweeps, oldest first; rows are overwritten by later appends"
+
+        n = min(self.count, self.capacity) if n is None else min(n, self.count, self.capacity)
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        rows = slice(end - n, end)
+        return self.ranges[rows], self.stamps[rows], self.status[rows]
+
+class TeraRangerBus:     # one I2C handle shared by every TeraRanger One on the bus
+
+    # Dead-sensor quarantine
+    RETRY_BUDGET = 3 # consecutive failed reads before a sensor is quarantined
+    QUARANTINE_MIN = 0.5 # seconds before the first retry, doubled after every failed retry
+    QUARANTINE_MAX = 30.0
+
+    # Discovery
+    DISCOVER_RETRIES = 2 # extra probes of the addresses that did not answer, for sensors still booting after a power-cycle
+    DISCOVER_SETTLE = 0.5 # seconds before each extra probe
+
+    batched = False # readRanges is no cheaper than reading the sensors one by one, unless pipelined
+
+    def __init__(self, bus=1, addresses=None, debug=False, freq=TeraRangerOne.I2C_STD, pipelined=False, i2c=None, fast=False):
+        if addresses is None:
+            addresses = [TeraRangerOne.TRONE_BASEADDR + i for i in range(6)]
+        self.x = i2c if i2c is not None else m.I2c(bus)
+        self.x.frequency(freq) # set once for the whole bus, not once per sensor
+        self.freq = freq
+        self.bus = bus
+        self.selected = None
+        self.debug = debug
+        self.pipelined = pipelined # trigger every sensor, then collect every result
+        self.fast = fast # plain 3 byte reads while the pointer is on the measure register; free-running firmware only, see TeraRangerOne
+        self.pointer = {} # address -> register last written to that sensor, while known
+        self.rangingTime = TeraRangerOne.TRONE_RANGING_TIME
+        self.clock = time.time
+        self.setAddresses(addresses)
+
+    def setAddresses(self, addresses):
+        "Replace the set of sensors read on every sweep"
+
+        self.addresses = list(addresses)
+        self.sensorCount = len(self.addresses)
+        self.resetQuarantine()
+
+    def resetQuarantine(self):
+        n = self.sensorCount
+        self.failures = [0] * n # consecutive failed reads
+        self.backoff = [0.0] * n # current quarantine length, 0 while healthy
+        self.retryAt = [0.0] * n
+        self.status = np.full(n, READ_SKIPPED, dtype=np.uint8) # READ_* outcome of each sensor's last read
+        self.latency = np.zeros(n) # seconds taken by each sensor's last transaction
+        self.stats = ReadStats(n)
+
+    def available(self, index):
+        "False while the sensor is quarantined and its next retry is not due yet"
+
+        return self.backoff[index] == 0 or self.clock() >= self.retryAt[index]
+
+    def quarantined(self):
+        "Quarantine flag of every sensor on the bus"
+
+        return [b > 0 for b in self.backoff]
+
+    def recordResult(self, index, ok, deb=False):
+        "Update the failure count of a sensor, quarantining it once its retry budget is spent"
+
+        self.stats.record(index, self.status[index], self.latency[index])
+
+        if ok:
+            if self.backoff[index] and (self.debug or deb):
+                print "trone (address = 0x%x) back from quarantine" % (self.addresses[index])
+            self.failures[index] = 0
+            self.backoff[index] = 0.0
+            return
+
+        self.failures[index] += 1
+        if self.backoff[index]:
+            self.backoff[index] = min(2 * self.backoff[index], self.QUARANTINE_MAX) # failed retry
+        elif self.failures[index] >= self.RETRY_BUDGET:
+            self.backoff[index] = self.QUARANTINE_MIN
+        else:
+            return
+
+        self.retryAt[index] = self.clock() + self.backoff[index]
+        if self.debug or deb:
+            print "trone (address = 0x%x) quarantined for %.1f s" % (self.addresses[index], self.backoff[index])
+
+    def probe(self, address, deb=False):
+        "True if a TeraRanger One answers WHO_AM_I at address"
+
+        self.pointer[address] = TeraRangerOne.TRONE_WHO_AM_I_REG
+
+        try:
+            self.select(address)
+            byte = self.x.readBytesReg(TeraRangerOne.TRONE_WHO_AM_I_REG, 1)
+        except:
+            if self.debug or deb:
+                print "TRBus probe: no answer at 0x%x" % (address)
+            self.selected = None
+            return False
+
+        return byte[0] == TeraRangerOne.TRONE_WHO_AM_I_VAL
+
+    def discover(self, candidates, cache=None, deb=False):
+        "Live addresses among candidates; with a cache file, only the cached addresses are checked once known"
+
+        key = str(self.bus)
+        cached = []
+        others = [] # cached addresses outside candidates, e.g. saved by a node with more sensors on the bus
+
+        if cache is not None:
+            entry = loadBusCache(cache).get(key) or []
+            cached = [a for a in entry if a in candidates]
+            others = [a for a in entry if a not in candidates]
+            if cached:
+                live = [a for a in cached if self.probe(a, deb=deb)]
+                if len(live) == len(cached):
+                    return live # fast path: the wiring has not changed since the last boot
+                if self.debug or deb:
+                    print "TRBus discover: cached sensors missing on bus %s, rescanning" % (key)
+
+        live = set(a for a in candidates if self.probe(a, deb=deb))
+        for attempt in range(self.DISCOVER_RETRIES):
+            missing = [a for a in candidates if a not in live]
+            if not missing:
+                break
+            time.sleep(self.DISCOVER_SETTLE) # a sensor may still be booting
+            live.update(a for a in missing if self.probe(a, deb=deb))
+
+        if cache is not None:
+            # a sensor that stayed silent through the retries is dropped, so the next boot takes the fast path
+            saveBusCache(cache, key, sorted(live.union(others)))
+
+        return [a for a in candidates if a in live]
+
+    def close(self):
+        pass # mraa releases the handle when it is garbage collected
+
+    def select(self, address):
+        "Point the shared handle at a sensor, skipping the call if it is already selected"
+
+        if address != self.selected:
+            self.x.address(address)
+            self.selected = address
+
+    def readRange(self, index, deb=False):
+        "Read the sensor at position index on the bus; a quarantined sensor costs no bus traffic"
+
+        if not self.available(index):
+            self.status[index] = READ_SKIPPED
+            return 1
+
+        range = self.readSensor(index, deb=deb)
+        self.recordResult(index, range != 1, deb=deb) # 1 is the driver's read/checksum failure value
+        return range
+
+    def pointerSet(self, index):
+        "True if the fast path may read the sensor at position index without writing the register first"
+
+        return self.fast and self.pointer.get(self.addresses[index]) == TeraRangerOne.TRONE_MEASURE_REG
+
+    def readFrame(self, index):
+        "Raw 3 byte frame of the sensor at position index; raises on a bus error"
+
+        address = self.addresses[index]
+
+        try:
+            self.select(address)
+            if self.pointerSet(index):
+                try:
+                    return self.x.read(3) # one transaction instead of a register write and a read
+                except:
+                    del self.pointer[address] # fall back to the register read below
+            self.pointer[address] = TeraRangerOne.TRONE_MEASURE_REG
+            return self.x.readBytesReg(TeraRangerOne.TRONE_MEASURE_REG, 3)
+        except:
+            self.pointer.pop(address, None)
+            self.selected = None # force a re-select after a bus error
+            raise
+
+    def readSensor(self, index, deb=False):
+        "Read 3 byte distance bytes from the sensor at position index on the bus"
+
+        address = self.addresses[index]
+
+        start = time.time()
+        try:
+            bytes3 = self.readFrame(index)
+        except:
+            if self.debug or deb:
+                print "TRBus readRange read failed (address = 0x%x)" % (address)
+            self.latency[index] = time.time() - start
+            self.status[index] = READ_ERROR
+            return 1
+        self.latency[index] = time.time() - start
+
+        range = self.checkFrame(bytes3, address, deb=deb)
+        self.status[index] = READ_OK if range != 1 else READ_CRC
+        if range == 1:
+            self.pointer.pop(address, None) # re-write the register on the next read, in case the pointer moved
+        return range
+
+    def setFrequency(self, mode):
+        "Switch the bus frequency mode; True if the backend supports it"
+
+        self.x.frequency(mode)
+        self.freq = mode
+        return True
+
+    def benchmarkFrequency(self, mode, sweeps=50):
+        "Read throughput and error rates of raw sweeps at one bus frequency mode"
+
+        self.setFrequency(mode)
+        reads = crcErrors = readErrors = 0
+        start = time.time()
+
+        for s in range(sweeps):
+            for i in range(self.sensorCount):
+                reads += 1
+                try:
+                    bytes3 = self.readFrame(i)
+                except:
+                    readErrors += 1
+                    continue
+                if crc16Table[bytes3[0] << 8 | bytes3[1]] != bytes3[2]:
+                    crcErrors += 1
+
+        elapsed = max(time.time() - start, 1e-9)
+        return {'mode': mode,
+                'reads_per_s': reads / elapsed,
+                'crc_error_rate': float(crcErrors) / max(reads, 1),
+                'read_error_rate': float(readErrors) / max(reads, 1)}
+
+    def calibrateFrequency(self, modes=None, sweeps=50, cache=None, deb=False):
+        "Benchmark each frequency mode, keep and persist the fastest error-free one (I2C_STD if none is)"
+
+        if modes is None:
+            modes = (TeraRangerOne.I2C_STD, TeraRangerOne.I2C_FAST, TeraRangerOne.I2C_HIGH)
+
+        results = [self.benchmarkFrequency(mode, sweeps) for mode in modes]
+        clean = [r for r in results if r['crc_error_rate'] == 0 and r['read_error_rate'] == 0]
+        best = max(clean, key=lambda r: r['reads_per_s'])['mode'] if clean else TeraRangerOne.I2C_STD
+
+        if self.debug or deb:
+            for r in results:
+                print "freq mode %d: %.0f reads/s, crc errors %.2f%%, read errors %.2f%%" % (
+                    r['mode'], r['reads_per_s'], 100 * r['crc_error_rate'], 100 * r['read_error_rate'])
+            print "selected freq mode %d" % (best)
+
+        self.setFrequency(best)
+        if cache is not None:
+            saveBusCache(cache, self.bus, best)
+
+        return best, results
+
+    def loadFrequency(self, cache):
+        "Apply the frequency mode calibrated on an earlier boot; False if there is none"
+
+        mode = loadBusCache(cache).get(str(self.bus))
+        if mode is None:
+            return False
+        return self.setFrequency(mode)
+
+    def trigger(self, index, deb=False):
+        "Start a measurement on the sensor at position index without waiting for it"
+
+        address = self.addresses[index]
+
+        try:
+            self.select(address)
+            self.x.writeByte(TeraRangerOne.TRONE_MEASURE_REG)
+        except:
+            if self.debug or deb:
+                print "TRBus trigger writeByte failed (address = 0x%x)" % (address)
+            self.selected = None
+            self.pointer.pop(address, None)
+            self.status[index] = READ_ERROR
+            return False
+
+        self.pointer[address] = TeraRangerOne.TRONE_MEASURE_REG
+        return True
+
+    def collect(self, index, deb=False):
+        "Read back the result of a measurement started by trigger"
+
+        address = self.addresses[index]
+
+        start = time.time()
+        try:
+            self.select(address)
+            bytes3 = self.x.read(3)
+        except:
+            if self.debug or deb:
+                print "TRBus collect read failed (address = 0x%x)" % (address)
+            self.selected = None
+            self.latency[index] = time.time() - start
+            self.status[index] = READ_ERROR
+            return 1
+        self.latency[index] = time.time() - start
+
+        range = self.checkFrame(bytes3, address, deb=deb)
+        self.status[index] = READ_OK if range != 1 else READ_CRC
+        return range
+
+    def readRanges(self, deb=False):
+        "Read every sensor on the bus once and return the ranges (mm) as one array"
+
+        if self.pipelined:
+            return self.readRangesPipelined(deb=deb)
+
+        ranges = np.empty(self.sensorCount, dtype=np.int32)
+
+        for i in range(self.sensorCount):
+            ranges[i] = self.readRange(i, deb=deb)
+
+        return ranges
+
+    def readRangesPipelined(self, deb=False):
+        "Trigger every sensor first, then collect every result, so the ranging times overlap"
+
+        return self.readGroup(range(self.sensorCount), deb=deb)
+
+    def readGroup(self, indices, deb=False):
+        "Fire the sensors at indices together and collect their ranges, in the order of indices"
+
+        ranges = np.ones(len(indices), dtype=np.int32)
+        active = [k for k in range(len(indices)) if self.available(indices[k])]
+        self.status[list(indices)] = READ_SKIPPED # until read below
+        start = time.time()
+        triggered = [k for k in active if self.trigger(indices[k], deb=deb)]
+
+        # results are collected in trigger order, so only wait out what is left of the first sensor's ranging time
+        remaining = self.rangingTime - (time.time() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+
+        for k in triggered:
+            ranges[k] = self.collect(indices[k], deb=deb)
+
+        for k in active:
+            self.recordResult(indices[k], ranges[k] != 1, deb=deb)
+
+        return ranges
+
+    def checkFrame(self, bytes3, address, deb=False):
+        "Validate a 3 byte frame, returning the range or 1 on a bad checksum"
+
+        range = bytes3[0] << 8 | bytes3[1]
+        crc = crc16Table[range]
+
+        if crc == bytes3[2]:
+            if self.debug or deb:
+                print "trone (address = 0x%x) ranged %2d mm" % (address, range)
+            return range
+        else:
+            if self.debug or deb:
+                print "trone (address = 0x%x) bad crc8: sent %d, computed %d" % (address, bytes3[2], crc)
+            return 1
+
+class i2c_msg(ctypes.Structure):     # struct i2c_msg from linux/i2c.h
+    _fields_ = [('addr', ctypes.c_uint16),
+                ('flags', ctypes.c_uint16),
+                ('len', ctypes.c_uint16),
+                ('buf', ctypes.POINTER(ctypes.c_uint8))]
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):     # struct i2c_rdwr_ioctl_data from linux/i2c-dev.h
+    _fields_ = [('msgs', ctypes.POINTER(i2c_msg)),
+                ('nmsgs', ctypes.c_uint32)]
+
+class I2cDevBus(TeraRangerBus):     # reads the whole bus through /dev/i2c-N with combined I2C_RDWR transactions
+
+    # linux/i2c-dev.h and linux/i2c.h
+    I2C_RDWR = 0x0707
+    I2C_M_RD = 0x0001
+    I2C_RDWR_IOCTL_MAX_MSGS = 42
+
+    batched = True # readRanges reads the whole bus in one ioctl
+
+    def __init__(self, bus=1, addresses=None, debug=False, pipelined=False, fd=None, ioctl=fcntl.ioctl, fast=False):
+        if addresses is None:
+            addresses = [TeraRangerOne.TRONE_BASEADDR + i for i in range(6)]
+        if fd is None:
+            fd = os.open("/dev/i2c-%d" % bus, os.O_RDWR)
+        self.fd = fd
+        self.ioctl = ioctl # swapped for a fake in tests
+        self.bus = bus
+        self.selected = None
+        self.debug = debug
+        self.pipelined = pipelined
+        self.fast = fast # free-running firmware only, see TeraRangerOne
+        self.pointer = {}
+        self.rangingTime = TeraRangerOne.TRONE_RANGING_TIME
+        self.clock = time.time
+        self.reg = (ctypes.c_uint8 * 1)(TeraRangerOne.TRONE_MEASURE_REG)
+        self.setAddresses(addresses)
+
+    def setAddresses(self, addresses):
+        "Replace the set of sensors and rebuild the message tables"
+
+        self.addresses = list(addresses)
+        self.sensorCount = len(self.addresses)
+
+        self.resetQuarantine()
+        self.subsets = {} # message tables for the sensors not in quarantine, keyed by (table, active)
+
+        # message tables are built once; every sweep reuses the same buffers
+        n = self.sensorCount
+        self.rxbuf = (ctypes.c_uint8 * (3 * n))()
+        self.frames = np.frombuffer(self.rxbuf, dtype=np.uint8).reshape(n, 3) # view on rxbuf, no copy
+        self.combined = (i2c_msg * (2 * n))() # write measure register + read 3 bytes, per sensor
+        self.writes = (i2c_msg * n)() # pipelined trigger phase
+        self.reads = (i2c_msg * n)() # pipelined collect phase
+        regp = ctypes.cast(self.reg, ctypes.POINTER(ctypes.c_uint8))
+
+        for i in range(n):
+            rxp = ctypes.cast(ctypes.byref(self.rxbuf, 3 * i), ctypes.POINTER(ctypes.c_uint8))
+            self.combined[2 * i] = i2c_msg(self.addresses[i], 0, 1, regp)
+            self.combined[2 * i + 1] = i2c_msg(self.addresses[i], self.I2C_M_RD, 3, rxp)
+            self.writes[i] = i2c_msg(self.addresses[i], 0, 1, regp)
+            self.reads[i] = i2c_msg(self.addresses[i], self.I2C_M_RD, 3, rxp)
+
+    def close(self):
+        os.close(self.fd)
+
+    def probe(self, address, deb=False):
+        "True if a TeraRanger One answers WHO_AM_I at address"
+
+        reg = (ctypes.c_uint8 * 1)(TeraRangerOne.TRONE_WHO_AM_I_REG)
+        byte = (ctypes.c_uint8 * 1)()
+        msgs = (i2c_msg * 2)(i2c_msg(address, 0, 1, ctypes.cast(reg, ctypes.POINTER(ctypes.c_uint8))),
+                             i2c_msg(address, self.I2C_M_RD, 1, ctypes.cast(byte, ctypes.POINTER(ctypes.c_uint8))))
+
+        self.pointer[address] = TeraRangerOne.TRONE_WHO_AM_I_REG
+
+        try:
+            self.transfer(msgs, 0, 2)
+        except (IOError, OSError):
+            if self.debug or deb:
+                print "TRDev probe: no answer at 0x%x" % (address)
+            return False
+
+        return byte[0] == TeraRangerOne.TRONE_WHO_AM_I_VAL
+
+    def transfer(self, msgs, first, count):
+        "Run count messages of msgs, starting at first, as combined I2C_RDWR transactions"
+
+        size = ctypes.sizeof(i2c_msg)
+        for start in range(first, first + count, self.I2C_RDWR_IOCTL_MAX_MSGS):
+            nmsgs = min(self.I2C_RDWR_IOCTL_MAX_MSGS, first + count - start)
+            ptr = ctypes.cast(ctypes.addressof(msgs) + start * size, ctypes.POINTER(i2c_msg))
+            self.ioctl(self.fd, self.I2C_RDWR, i2c_rdwr_ioctl_data(ptr, nmsgs))
+
+    def activeMessages(self, table, stride, active):
+        "Messages of table for the active sensors only, built once per distinct quarantine state"
+
+        if len(active) == self.sensorCount:
+            return table
+        key = (id(table), tuple(active))
+        if key not in self.subsets:
+            msgs = [table[stride * i + j] for i in active for j in range(stride)]
+            self.subsets[key] = (i2c_msg * len(msgs))(*msgs) # copies keep pointing at the shared buffers
+        return self.subsets[key]
+
+    def readFrame(self, index):
+        "Raw frame of one sensor from a single combined write/read transaction; raises on a bus error"
+
+        address = self.addresses[index]
+
+        if self.pointerSet(index):
+            try:
+                self.transfer(self.reads, index, 1)
+                return self.rxbuf[3 * index:3 * index + 3]
+            except (IOError, OSError):
+                del self.pointer[address]
+
+        try:
+            self.transfer(self.combined, 2 * index, 2)
+        except:
+            self.pointer.pop(address, None)
+            raise
+        self.pointer[address] = TeraRangerOne.TRONE_MEASURE_REG
+        return self.rxbuf[3 * index:3 * index + 3]
+
+    def setFrequency(self, mode):
+        "i2c-dev cannot change the bus clock; it is set by the kernel driver"
+
+        return False
+
+    def calibrateFrequency(self, modes=None, sweeps=50, cache=None, deb=False):
+        return None, []
+
+    def trigger(self, index, deb=False):
+        try:
+            self.transfer(self.writes, index, 1)
+        except (IOError, OSError):
+            self.pointer.pop(self.addresses[index], None)
+            self.status[index] = READ_ERROR
+            return False
+        self.pointer[self.addresses[index]] = TeraRangerOne.TRONE_MEASURE_REG
+        return True
+
+    def collect(self, index, deb=False):
+        start = time.time()
+        try:
+            self.transfer(self.reads, index, 1)
+        except (IOError, OSError):
+            self.latency[index] = time.time() - start
+            self.status[index] = READ_ERROR
+            return 1
+        self.latency[index] = time.time() - start
+        range = self.checkFrame(self.rxbuf[3 * index:3 * index + 3], self.addresses[index], deb=deb)
+        self.status[index] = READ_OK if range != 1 else READ_CRC
+        return range
+
+    def readRanges(self, deb=False):
+        "Read every sensor on the bus in one ioctl and return the ranges (mm) as one array"
+
+        if self.pipelined:
+            return self.readRangesPipelined(deb=deb)
+
+        active = [i for i in range(self.sensorCount) if self.available(i)]
+        self.status[:] = READ_SKIPPED # until checked below
+
+        # plain reads only if every active sensor's pointer is known; a single combined transaction otherwise
+        if all(self.pointerSet(i) for i in active):
+            table, stride = self.reads, 1
+        else:
+            table, stride = self.combined, 2
+
+        try:
+            start = time.time()
+            self.transfer(self.activeMessages(table, stride, active), 0, stride * len(active))
+            self.latency[active] = time.time() - start # one transaction delivers every frame
+            for i in active:
+                self.pointer[self.addresses[i]] = TeraRangerOne.TRONE_MEASURE_REG
+        except (IOError, OSError):
+            for i in active:
+                self.pointer.pop(self.addresses[i], None)
+            # a single NAK fails the whole transaction; fall back to one sensor at a time
+            if self.debug or deb:
+                print "TRDev readRanges I2C_RDWR failed, reading sensors one by one"
+            return TeraRangerBus.readRanges(self, deb=deb)
+
+        return self.checkFrames(active, deb=deb)
+
+    def readRangesPipelined(self, deb=False):
+        "Trigger every sensor in one ioctl, then collect every result in a second one"
+
+        return self.readGroup(range(self.sensorCount), deb=deb)
+
+    def readGroup(self, indices, deb=False):
+        "Trigger the sensors at indices in one ioctl, then collect them in a second one"
+
+        active = [i for i in indices if self.available(i)]
+        self.status[list(indices)] = READ_SKIPPED # until checked below
+
+        try:
+            start = time.time()
+            self.transfer(self.activeMessages(self.writes, 1, active), 0, len(active))
+            for i in active:
+                self.pointer[self.addresses[i]] = TeraRangerOne.TRONE_MEASURE_REG
+            remaining = self.rangingTime - (time.time() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+            collected = time.time()
+            self.transfer(self.activeMessages(self.reads, 1, active), 0, len(active))
+            self.latency[active] = time.time() - collected
+        except (IOError, OSError):
+            if self.debug or deb:
+                print "TRDev readGroup I2C_RDWR failed, reading sensors one by one"
+            return TeraRangerBus.readGroup(self, indices, deb=deb)
+
+        return self.checkFrames(active, deb=deb)[list(indices)]
+
+    def checkFrames(self, active, deb=False):
+        "Validate every frame in the receive buffer in one vectorized pass; sensors not in active read as 1"
+
+        ranges, valid = validateFrames(self.frames)
+        skipped = np.ones(self.sensorCount, dtype=bool)
+        skipped[active] = False
+        valid[skipped] = False # stale frames of quarantined sensors
+        ranges[~valid] = 1
+        self.status[active] = np.where(valid[active], READ_OK, READ_CRC)
+
+        for i in active:
+            self.recordResult(i, valid[i], deb=deb)
+            if not valid[i]:
+                self.pointer.pop(self.addresses[i], None)
+
+        if self.debug or deb:
+            for i in range(self.sensorCount):
+                print "trone (address = 0x%x) ranged %2d mm, crc8 %s" % (self.addresses[i], ranges[i], "ok" if valid[i] else "bad")
+
+        return ranges
+
 if __name__ == "__main__":
 
     #trone = TeraRangerOne(address=0x40, debug=True)
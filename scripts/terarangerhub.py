@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+import os
+import io
+import tty
+import time
+import termios
+import numpy as np
+
+from teraranger import crc16Table
+
+# TeraRanger Hub serial stream driver. In binary mode the hub streams 20 byte frames:
+# 'T' 'H', 8 big-endian uint16 ranges (mm), a sensor mask byte and a CRC8 over the first 19 bytes.
+
+HUB_SENSORS = 8
+HUB_FRAME_SIZE = 20
+HUB_HEADER = b'TH'
+
+# special range values in a hub frame
+HUB_TOO_CLOSE = 0x0000
+HUB_INVALID = 0x0001
+HUB_TOO_FAR = 0xFFFF
+
+def crc8(data, start, end):
+    "CRC8 of data[start:end], two bytes per lookup in the 16-bit table"
+
+    crc = 0
+    i = start
+    while i + 1 < end:
+        crc = crc16Table[(crc ^ data[i]) << 8 | data[i + 1]]
+        i += 2
+    if i < end:
+        crc = crc16Table[crc ^ data[i]] # (0 << 8 | b) is the single byte CRC of b
+    return crc
+
+def command(*payload):
+    "Hub command bytes with the trailing CRC8"
+
+    data = bytearray(payload)
+    data.append(crc8(data, 0, len(data)))
+    return data
+
+class HubParser:     # incremental frame parser over one preallocated buffer
+
+    def __init__(self, size=4096):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0 # first unparsed byte
+        self.end = 0 # one past the last received byte
+        self.frames = 0
+        self.badFrames = 0 # checksum failures, each followed by a resync
+        self.droppedBytes = 0 # bytes skipped while looking for a header
+
+    def space(self):
+        "Writable tail of the buffer, for readinto; compacts the buffer first if needed"
+
+        if self.end + HUB_FRAME_SIZE > len(self.buf):
+            leftover = self.end - self.start
+            self.buf[0:leftover] = self.buf[self.start:self.end] # never more than a partial frame or two
+            self.start = 0
+            self.end = leftover
+        return self.view[self.end:]
+
+    def received(self, count):
+        "Account for count bytes written into space()"
+
+        self.end += count
+
+    def feed(self, data):
+        "Copy data into the buffer and parse it; data of any length, parsed a buffer at a time"
+
+        ranges = []
+        masks = []
+        i = 0
+        while i < len(data):
+            space = self.space()
+            n = min(len(space), len(data) - i)
+            space[0:n] = data[i:i + n]
+            self.received(n)
+            i += n
+            if i < len(data): # buffer full: parse it to make room for the rest
+                r, m = self.parse()
+                ranges.append(r)
+                masks.append(m)
+        r, m = self.parse()
+        ranges.append(r)
+        masks.append(m)
+        return np.concatenate(ranges), np.concatenate(masks)
+
+    def parse(self):
+        "Every complete, valid frame in the buffer as an (N, 8) array of ranges (mm) and an (N,) array of masks"
+
+        good = []
+        buf = self.buf
+
+        while self.end - self.start >= HUB_FRAME_SIZE:
+            head = buf.find(HUB_HEADER, self.start, self.end)
+            if head < 0:
+                # keep a trailing 'T' that may be the start of the next header
+                keep = 1 if buf[self.end - 1] == ord('T') else 0
+                self.droppedBytes += self.end - keep - self.start
+                self.start = self.end - keep
+                break
+            self.droppedBytes += head - self.start
+            self.start = head
+            if self.end - head < HUB_FRAME_SIZE:
+                break
+            if crc8(buf, head, head + HUB_FRAME_SIZE - 1) == buf[head + HUB_FRAME_SIZE - 1]:
+                good.append(head)
+                self.start = head + HUB_FRAME_SIZE
+            else:
+                self.badFrames += 1
+                self.start = head + 1 # resync on the next header
+
+        self.frames += len(good)
+        ranges = np.empty((len(good), HUB_SENSORS), dtype=np.int32)
+        masks = np.empty(len(good), dtype=np.uint8)
+        for k in range(len(good)):
+            ranges[k] = np.frombuffer(self.buf, dtype='>u2', count=HUB_SENSORS, offset=good[k] + 2)
+            masks[k] = buf[good[k] + 2 + 2 * HUB_SENSORS]
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        return ranges, masks
+
+class TeraRangerHub:     # owns the serial port of one hub
+
+    BINARY_MODE = command(0x00, 0x11, 0x02)
+    ENABLE = command(0x00, 0x52, 0x02, 0x01)
+    DISABLE = command(0x00, 0x52, 0x02, 0x00)
+    RATE_ASAP = command(0x00, 0x52, 0x03, 0x01)
+    RATE_50 = command(0x00, 0x52, 0x03, 0x02)
+    RATE_100 = command(0x00, 0x52, 0x03, 0x03)
+    RATE_250 = command(0x00, 0x52, 0x03, 0x04)
+    RATE_500 = command(0x00, 0x52, 0x03, 0x05)
+    RATE_600 = command(0x00, 0x52, 0x03, 0x06)
+
+    def __init__(self, port="/dev/ttyACM0", rate=None, debug=False, configure=True):
+        self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[6][termios.VMIN] = 1
+        attrs[6][termios.VTIME] = 1 # return what has arrived after 0.1 s of silence
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self.stream = io.FileIO(self.fd, 'r+b', closefd=False)
+        self.parser = HubParser()
+        self.debug = debug
+
+        if configure:
+            self.write(self.BINARY_MODE)
+            if rate is not None:
+                self.write(rate)
+            self.write(self.ENABLE)
+
+    def write(self, data):
+        os.write(self.fd, bytes(data))
+
+    def close(self):
+        try:
+            self.write(self.DISABLE)
+        finally:
+            os.close(self.fd)
+
+    def read(self):
+        "Block for the next chunk of the stream; returns the frames it completed (see HubParser.parse)"
+
+        count = self.stream.readinto(self.parser.space())
+        if count:
+            self.parser.received(count)
+        ranges, masks = self.parser.parse()
+
+        if self.debug:
+            for r in ranges:
+                print "hub ranged", r
+        return ranges, masks
+
+if __name__ == "__main__":
+
+    # feed a pty with a noisy stream and check the parser resynchronises
+    import pty
+
+    master, slave = pty.openpty()
+    hub = TeraRangerHub(os.ttyname(slave), configure=False)
+
+    def frame(ranges, mask=0xFF):
+        data = bytearray(HUB_HEADER) + bytearray(np.array(ranges, dtype='>u2').tobytes()) + bytearray([mask])
+        data.append(crc8(data, 0, len(data)))
+        return data
+
+    good = frame([1000 + i for i in range(HUB_SENSORS)])
+    bad = bytearray(good)
+    bad[5] ^= 0x40
+    os.write(master, bytes(bytearray(b'xxT') + good + bad[:7] + good + bad + good[:11]))
+    time.sleep(0.1)
+    ranges, masks = hub.read()
+    print ranges, masks
+    print "frames", hub.parser.frames, "bad", hub.parser.badFrames, "dropped bytes", hub.parser.droppedBytes
+
+    # an offline log far larger than the buffer parses in one feed
+    ranges, masks = HubParser().feed(bytes(good * 1000 + bad + good * 1000))
+    print "offline log:", len(ranges), "frames"
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+# import main ROS python library
+
+import rospy
+import terarangerhub
+
+from sensor_msgs.msg import Range
+from teraranger_array.msg import RangeArray
+
+# simple class to contain the node's variables and code
+
+class TRHubSerialNode:     # streams a TeraRanger Hub over serial and publishes one RangeArray per frame
+    def __init__(self):
+        self.port = rospy.get_param("~port", "/dev/ttyACM0")
+        self.sensorCount = terarangerhub.HUB_SENSORS
+        self.report_period = 5 # seconds between stream reports
+
+        self.hub = terarangerhub.TeraRangerHub(self.port, rate=terarangerhub.TeraRangerHub.RATE_ASAP)
+        self.range_pub = rospy.Publisher("teraranger_hub_one", RangeArray, queue_size=1)
+
+        # message reused for every frame; only the ranges and stamp change
+        self.msg = RangeArray()
+        self.msg.header.frame_id = "base_range"
+        for i in range(self.sensorCount):
+            r = Range()
+            r.header.frame_id = "base_range_%d" % (i)
+            r.radiation_type = Range.INFRARED
+            r.field_of_view = 0.0593
+            r.min_range = 0.2
+            r.max_range = 14.0
+            self.msg.ranges.append(r)
+
+        last_report = rospy.get_time()
+
+        while not rospy.is_shutdown():
+            ranges, masks = self.hub.read()
+            if len(ranges):
+                self.publish(ranges[-1]) # only the newest frame of a chunk; older ones are already stale
+            if rospy.get_time() - last_report > self.report_period:
+                parser = self.hub.parser
+                rospy.loginfo("teraranger hub: %d frames, %d bad, %d bytes dropped", parser.frames, parser.badFrames, parser.droppedBytes)
+                last_report = rospy.get_time()
+
+        self.hub.close()
+
+    def publish(self, ranges):
+        # too close (0), invalid (1) and too far (0xFFFF) all fall outside [min_range, max_range]
+        stamp = rospy.Time.now()
+        self.msg.header.stamp = stamp
+        for i in range(self.sensorCount):
+            self.msg.ranges[i].header.stamp = stamp
+            self.msg.ranges[i].range = ranges[i] / 1000.0
+        self.range_pub.publish(self.msg)
+
+if __name__ == "__main__":     # initialize the ROS client API, giving the default node name
+
+    rospy.init_node("teraranger_hub_node")
+
+    node = TRHubSerialNode()
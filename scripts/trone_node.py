@@ -0,0 +1,301 @@
+#!/usr/bin/python
+
+import os
+import rospy
+import numpy as np
+import teraranger
+import acquisition
+import fake_i2c
+from teraranger_array.msg import RangeArray
+
+# import the Float32 message type
+
+from sensor_msgs.msg import LaserScan, Range
+from std_msgs.msg import UInt8MultiArray
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+# TeraRanger One array node shared by trone_py.py (4 sensors) and trhub_py.py (6 sensors)
+
+class TROneNode:     # class constructor; subscribe to topics and advertise intent to publish
+    def __init__(self, sensorCount=6):
+        self.sensorCount = sensorCount # the number of sensors to attempt to add
+        self.update_rate = rospy.get_param("~rate", 50) # hertz, aggregate reads over all sensors of a bus
+        self.report_period = 5 # seconds between scheduler reports
+        self.diagnostics_period = rospy.get_param("~diagnostics_period", 1.0) # seconds between /diagnostics messages
+        self.pipelined = rospy.get_param("~pipelined", False) # trigger all sensors, then read all results
+        self.backend = rospy.get_param("~backend", "mraa") # "mraa" or "i2cdev" (one I2C_RDWR ioctl per sweep)
+        # plain 3 byte reads once the register pointer is set; only for sensors confirmed to measure on every read,
+        # a TeraRanger One starts a measurement on the register write and would keep returning its last frame
+        self.fast_read = rospy.get_param("~fast_read", False)
+        self.replay = rospy.get_param("~replay", "") # recorded frames to replay through fake_i2c instead of the bus
+        self.bus_map = rospy.get_param("~bus_map", [1] * self.sensorCount) # I2C bus of each sensor, e.g. [1, 1, 1, 2, 2, 2]
+        self.discover = rospy.get_param("~discover", True) # probe which addresses are alive on each bus
+        self.address_cache = rospy.get_param("~address_cache", os.path.expanduser("~/.ros/teraranger_addresses.json"))
+        self.calibrate_freq = rospy.get_param("~calibrate_freq", False) # benchmark the I2C frequency modes at startup
+        self.freq_cache = rospy.get_param("~freq_cache", os.path.expanduser("~/.ros/teraranger_frequency.json"))
+        self.publish_mode = rospy.get_param("~publish_mode", "scan") # "scan": a LaserScan per sensor, "array": a RangeArray per sweep
+        self.publish_rate = rospy.get_param("~publish_rate", 0) # hertz; 0 publishes at the sweep rate
+        self.history = rospy.get_param("~history", 256) # sweeps of raw ranges, stamps and read status kept in self.ring
+        self.crosstalk = rospy.get_param("~crosstalk", []) # sensor pairs that interfere, e.g. [[0, 1], [1, 2]], or "ring"; empty fires one at a time
+#        self.update_timer = 1/ (self.update_rate)
+        self.discover_retry = rospy.get_param("~discover_retry", 2.0) # seconds between discovery attempts while no sensor answers
+        self.buses = []
+
+        while not rospy.is_shutdown():
+            try:
+                self.buses = self.makeBuses()
+            except:
+                print "error initializing terarangers"
+            if self.buses:
+                break
+            rospy.logerr("terarangers: no sensor answered on bus %s, retrying discovery in %.1f s",
+                         sorted(set(self.bus_map)), self.discover_retry)
+            try:
+                rospy.sleep(self.discover_retry)
+            except rospy.ROSInterruptException:
+                break
+
+        if not self.buses:
+            return # shut down before any sensor answered
+
+        try:
+            self.sensorIndex = [a - 0x30 for bus in self.buses for a in bus.addresses] # publisher of each swept range
+            rospy.loginfo("terarangers found: %s", ", ".join("bus %d: %s" % (bus.bus, [hex(a) for a in bus.addresses]) for bus in self.buses))
+            self.range_pub = [rospy.Publisher("teraranger%d/laser/scan" %(i+1), LaserScan, queue_size=1) for i in range(self.sensorCount)]       
+            self.quarantine_pub = rospy.Publisher("teraranger/quarantined", UInt8MultiArray, queue_size=1, latch=True)
+            self.array_pub = rospy.Publisher("teraranger_hub_one", RangeArray, queue_size=1)
+            self.diagnostics_pub = rospy.Publisher("/diagnostics", DiagnosticArray, queue_size=1)
+            self.array_msg = self.makeRangeArray()
+            self.quarantine = None
+        except:
+            print "error initializing terarangers"
+
+        groups = [self.firingGroups(bus) for bus in self.buses] if self.crosstalk else None
+        if groups is not None:
+            for k in range(len(self.buses)):
+                rospy.loginfo("bus %d firing groups: %s", self.buses[k].bus,
+                              [[hex(self.buses[k].addresses[i]) for i in g] for g in groups[k]])
+
+        if len(self.buses) == 1:
+            bus = self.buses[0]
+            readAll = bus.readRanges if bus.pipelined or bus.batched else None # whole-sweep reads when they save transactions
+            self.scheduler = acquisition.SweepScheduler(bus.readRange, bus.sensorCount, rate=self.update_rate, readAll=readAll,
+                                                        groups=groups[0] if groups else None, readGroup=bus.readGroup)
+        else:
+            # one thread per bus; each bus gets the full rate since reads on different buses overlap
+            counts = np.cumsum([0] + [bus.sensorCount for bus in self.buses])
+            indices = [range(counts[k], counts[k + 1]) for k in range(len(self.buses))]
+            self.scheduler = acquisition.MultiBusAcquisition(self.buses, indices, rate=self.update_rate, groups=groups)
+            self.scheduler.start()
+
+        # I2C reads run on their own thread; publishing only ever takes the latest sweep
+        self.ring = teraranger.RangeRing(self.history, [a for bus in self.buses for a in bus.addresses])
+        status = lambda: np.concatenate([bus.status for bus in self.buses])
+        self.acquisition = acquisition.AcquisitionThread(self.scheduler, len(self.sensorIndex), ring=self.ring, status=status)
+        self.acquisition.start()
+        self.published = 0 # seq of the last sweep published
+
+        if self.publish_rate <= 0:
+            self.publish_rate = self.update_rate / float(max(bus.sensorCount for bus in self.buses))
+        rate = rospy.Rate(self.publish_rate)
+        last_report = rospy.get_time()
+        last_diagnostics = rospy.get_time()
+
+        while not rospy.is_shutdown():
+            self.timer_callback()
+            if rospy.get_time() - last_report > self.report_period:
+                self.report()
+                last_report = rospy.get_time()
+            if rospy.get_time() - last_diagnostics > self.diagnostics_period:
+                self.publishDiagnostics()
+                last_diagnostics = rospy.get_time()
+            try:
+                rate.sleep()
+            except rospy.ROSInterruptException:
+                break
+
+        self.acquisition.stop()
+
+        # create the Timer with period self.moving_average_period
+#        rospy.Timer(rospy.Duration(self.update_timer, self.timer_callback))
+
+        # print out a message for debugging
+#        rospy.loginfo("Created terarangers publishing node with period of %f seconds", self.update_timer)
+
+    # the callback function for the timer event
+    def timer_callback(self):         # create the message containing the moving average
+
+        seq, ranges, stamps = self.acquisition.read()
+        if seq == self.published:
+            return # no new sweep since the last publish
+        self.published = seq
+
+        quarantined = [q for bus in self.buses for q in bus.quarantined()]
+        self.publishQuarantine(quarantined)
+
+        if self.publish_mode == "array":
+            self.publishArray(ranges, stamps, quarantined)
+            return
+
+        for k in range(len(ranges)):
+            #print "publishing"
+            if quarantined[k]:
+                continue # dead or unplugged; its state is on teraranger/quarantined
+            i = self.sensorIndex[k]
+            distance = ranges[k]
+            #print distance
+            #if (distance < 14000 and distance > 200):
+            terarangers_msg = LaserScan()
+            terarangers_msg.header.frame_id = "base_range"
+            terarangers_msg.header.stamp = rospy.Time.from_sec(stamps[k])
+            terarangers_msg.angle_min = 0
+            terarangers_msg.angle_max = 0
+            terarangers_msg.angle_increment = 0
+            terarangers_msg.time_increment = 0 # 14 metres
+            terarangers_msg.scan_time = 0
+            terarangers_msg.range_min = 200
+            terarangers_msg.range_max = 14000
+            terarangers_msg.ranges = [distance/1000.0]
+            terarangers_msg.intensities = [0]
+                # publish the moving average
+            self.range_pub[i].publish(terarangers_msg)
+
+    def makeRangeArray(self):
+        "RangeArray reused for every sweep; only the ranges and stamps change"
+
+        msg = RangeArray()
+        msg.header.frame_id = "base_range"
+        for i in range(self.sensorCount):
+            r = Range()
+            r.header.frame_id = "base_range_%d" % (i)
+            r.radiation_type = Range.INFRARED
+            r.min_range = 0.2
+            r.max_range = 14.0
+            msg.ranges.append(r)
+        return msg
+
+    def publishArray(self, ranges, stamps, quarantined):
+        "Publish the whole sweep as one RangeArray; invalid, quarantined and missing sensors read NaN"
+
+        stamp = rospy.Time.from_sec(stamps.max()) # the sweep is complete at its last read
+        msg = self.array_msg
+        msg.header.stamp = stamp
+
+        for r in msg.ranges:
+            r.header.stamp = stamp
+            r.range = float('nan')
+
+        for k in range(len(ranges)):
+            if ranges[k] != 1 and not quarantined[k]: # 1 is the driver's failed read value
+                msg.ranges[self.sensorIndex[k]].range = ranges[k] / 1000.0
+
+        self.array_pub.publish(msg)
+
+    def publishQuarantine(self, quarantined):
+        "Publish the quarantine flag of every sensor index whenever it changes"
+
+        flags = [0] * self.sensorCount
+        for k in range(len(quarantined)):
+            flags[self.sensorIndex[k]] = int(quarantined[k])
+
+        if flags != self.quarantine:
+            self.quarantine = flags
+            self.quarantine_pub.publish(UInt8MultiArray(data=flags))
+
+    def makeBuses(self):
+        "One bus object per I2C bus of bus_map holding live sensors, discovered and frequency calibrated if enabled"
+
+        buses = []
+        candidates = [0x30 + i for i in range(self.sensorCount)]
+        for b in sorted(set(self.bus_map)):
+            bus = self.makeBus(b, [candidates[i] for i in range(self.sensorCount) if self.bus_map[i] == b])
+            if self.discover:
+                # the cache makes later boots check only the addresses found last time
+                found = [a for other in buses for a in other.addresses]
+                bus.setAddresses(bus.discover([a for a in candidates if a not in found], cache=self.address_cache))
+            if bus.sensorCount == 0:
+                bus.close()
+                continue
+            if self.calibrate_freq:
+                mode, results = bus.calibrateFrequency(cache=self.freq_cache)
+                for r in results:
+                    rospy.loginfo("bus %d freq mode %d: %.0f reads/s, %.2f%% crc errors, %.2f%% read errors", b, r['mode'],
+                                  r['reads_per_s'], 100 * r['crc_error_rate'], 100 * r['read_error_rate'])
+                rospy.loginfo("bus %d: using freq mode %s", b, mode)
+            else:
+                bus.loadFrequency(self.freq_cache) # mode picked by an earlier calibration, if any
+            buses.append(bus)
+        return buses
+
+    def makeBus(self, bus, addresses):
+        fake = fake_i2c.FakeI2c.fromLog(self.replay) if self.replay else None # one per bus, threads must not share it
+        if self.backend == "i2cdev" and fake is not None:
+            return teraranger.I2cDevBus(bus=bus, addresses=addresses, debug=False, pipelined=self.pipelined, fd=-1, ioctl=fake.ioctl,
+                                        fast=self.fast_read)
+        elif self.backend == "i2cdev":
+            return teraranger.I2cDevBus(bus=bus, addresses=addresses, debug=False, pipelined=self.pipelined, fast=self.fast_read)
+        else:
+            return teraranger.TeraRangerBus(bus=bus, addresses=addresses, debug=False, pipelined=self.pipelined, i2c=fake,
+                                            fast=self.fast_read)
+
+    def firingGroups(self, bus):
+        "Crosstalk-free firing groups of the sensors of bus, as positions in its address list"
+
+        if self.crosstalk == "ring":
+            adjacency = acquisition.ringAdjacency(self.sensorCount)
+        else:
+            adjacency = self.crosstalk
+
+        # the crosstalk graph is over sensor indices; only sensors on this bus fire together
+        local = dict((bus.addresses[i] - 0x30, i) for i in range(bus.sensorCount))
+        edges = [(local[a], local[b]) for a, b in adjacency if a in local and b in local]
+        return acquisition.firingGroups(edges, bus.sensorCount)
+
+    def publishDiagnostics(self):
+        "Publish the read health of every sensor: latency histogram, CRC and bus error counts, achieved rate"
+
+        rates = self.scheduler.stats()['sensor_rates']
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        k = 0 # position in the swept ranges
+
+        for bus in self.buses:
+            stats = bus.stats
+            for i in range(bus.sensorCount):
+                status = DiagnosticStatus()
+                status.name = "teraranger%d" % (self.sensorIndex[k] + 1)
+                status.hardware_id = "i2c-%d 0x%x" % (bus.bus, bus.addresses[i])
+                reads = stats.reads[i]
+                failures = stats.crcErrors[i] + stats.busErrors[i]
+                if bus.backoff[i]:
+                    status.level = DiagnosticStatus.ERROR
+                    status.message = "quarantined"
+                elif reads and failures > 0.05 * reads:
+                    status.level = DiagnosticStatus.WARN
+                    status.message = "%.1f%% failed reads" % (100.0 * failures / reads)
+                else:
+                    status.level = DiagnosticStatus.OK
+                    status.message = "ok"
+                status.values = [KeyValue("rate (Hz)", "%.1f" % rates[k]),
+                                 KeyValue("reads", str(reads)),
+                                 KeyValue("crc errors", str(stats.crcErrors[i])),
+                                 KeyValue("bus errors", str(stats.busErrors[i])),
+                                 KeyValue("latency p50 (ms)", "%.2f" % (1000 * stats.percentile(i, 50))),
+                                 KeyValue("latency p99 (ms)", "%.2f" % (1000 * stats.percentile(i, 99))),
+                                 KeyValue("latency max (ms)", "%.2f" % (1000 * stats.maxLatency[i])),
+                                 KeyValue("latency histogram (ms)", " ".join("%.2g:%d" % (1000 * e, c) for e, c in
+                                                                             zip(stats.LATENCY_EDGES, stats.histogram[i]) if c))]
+                msg.status.append(status)
+                k += 1
+
+        self.diagnostics_pub.publish(msg)
+
+    def report(self):
+        stats = self.scheduler.stats()
+        rospy.loginfo("terarangers: %.1f Hz achieved (target %.1f Hz), %d/%d reads and %d/%d sweeps missed their deadline",
+                      stats['achieved_rate'], stats['target_rate'], stats['missed_reads'], stats['reads'],
+                      stats['missed_sweeps'], stats['sweeps'])
+        rates = [0.0] * self.sensorCount
+        for k in range(len(stats['sensor_rates'])):
+            rates[self.sensorIndex[k]] = stats['sensor_rates'][k]
+        rospy.loginfo("terarangers: valid readings per sensor %s Hz", " ".join("%.1f" % r for r in rates))